@@ -0,0 +1,230 @@
+"""
+Versioned JSON API (/api/v1) for the catalog, the cart and orders.
+
+Every endpoint accepts ?fields=a,b,c to choose the returned fields; that list
+becomes the MongoDB projection. Lists are cursor-paginated: the response
+carries "next", to be sent back as ?after= (or ?page= for relevance-ranked
+search). They are streamed document by document, so large pages never sit
+in memory as one JSON string.
+"""
+import json
+import os
+from datetime import datetime
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from flask import Blueprint, Response, request, session, stream_with_context
+
+from carts import add_item, remove_item, get_cart, CART_PRODUCT_PROJECTION
+from catalog import ListingQuery, decode_cursor, encode_cursor, keyset_filter, parse_page_size
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the standard library encoder
+    orjson = None
+
+# Largest page a client may request; pages are streamed, so this can exceed the HTML listing's
+API_MAX_PAGE_SIZE = int(os.getenv("API_MAX_PAGE_SIZE", "1000"))
+
+# Selectable fields per resource; the first list is the default selection
+PRODUCT_FIELDS = ["nombre", "precio", "moneda", "descripcion", "categoria", "imagenes",
+                  "rating_avg", "rating_count", "sku", "stock", "atributos", "fecha_creacion", "visible"]
+PRODUCT_DEFAULT_FIELDS = PRODUCT_FIELDS[:8]
+CART_FIELDS = ["items", "subtotal", "cantidad_items", "fecha_actualizacion"]
+ORDER_FIELDS = ["numero_pedido", "fecha_pedido", "total", "estado", "items", "subtotal",
+                "impuestos", "descuentos", "direccion_envio", "pago"]
+ORDER_DEFAULT_FIELDS = ORDER_FIELDS[:4]
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    """
+    JSON bytes for documents holding ObjectIds and datetimes.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def json_response(value, status=200):
+    return Response(dumps(value), status=status, mimetype="application/json")
+
+
+def error(code, status):
+    return json_response({"error": code}, status)
+
+
+def selected_fields(allowed, default):
+    """
+    Fields requested with ?fields=, restricted to `allowed`.
+    """
+    raw = request.args.get("fields")
+    if not raw:
+        return list(default)
+    return [f for f in (part.strip() for part in raw.split(",")) if f in allowed] or list(default)
+
+
+def _shape(fields):
+    def shape(doc):
+        return {"id": doc["_id"], **{f: doc[f] for f in fields if f in doc}}
+    return shape
+
+
+def stream_page(cursor, page_size, shape, next_of):
+    """
+    Streams {"data": [...], "next": ...}. `cursor` must be limited to
+    page_size + 1 rows: the extra row only signals that a next page exists,
+    and next_of(last document shown) builds its token.
+    """
+
+    def generate():
+        yield b'{"data":['
+        last, more = None, False
+        for n, doc in enumerate(cursor):
+            if n == page_size:
+                more = True
+                break
+            yield (b"," if n else b"") + dumps(shape(doc))
+            last = doc
+        yield b'],"next":' + dumps(next_of(last) if more else None) + b"}"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+def _object_id(value):
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def _current_user_id():
+    user = session.get("user")
+    return ObjectId(user["id"]) if user else None
+
+
+def create_blueprint(db, category_tree):
+    """
+    Builds the /api/v1 blueprint over the application's database handle and
+    category tree cache.
+    """
+    api = Blueprint("api_v1", __name__, url_prefix="/api/v1")
+
+    # --- Catalog ---
+
+    @api.route("/products")
+    def products():
+        listing = ListingQuery(request.args, category_tree, max_page_size=API_MAX_PAGE_SIZE)
+        fields = selected_fields(PRODUCT_FIELDS, PRODUCT_DEFAULT_FIELDS)
+        projection = {f: 1 for f in fields}
+        # Keep what sorting and the next cursor need (sort key or text score)
+        projection.update({k: v for k, v in listing.projection.items()
+                           if k == getattr(listing, "sort_field", None) or k == "score"})
+        cursor = listing.apply(db.productos.find(listing.filter, projection))
+
+        def next_of(last):
+            if listing.ranked:
+                return str(listing.page + 1)
+            return encode_cursor(last, listing.sort_field)
+
+        return stream_page(cursor, listing.page_size, _shape(fields), next_of)
+
+    @api.route("/products/<product_id>")
+    def product(product_id):
+        oid = _object_id(product_id)
+        fields = selected_fields(PRODUCT_FIELDS, PRODUCT_FIELDS)
+        doc = db.productos.find_one({"_id": oid, "visible": True}, {f: 1 for f in fields}) if oid else None
+        if doc is None:
+            return error("product_not_found", 404)
+        return json_response({"data": _shape(fields)(doc)})
+
+    # --- Cart ---
+
+    @api.route("/cart")
+    def cart():
+        user_id = _current_user_id()
+        if user_id is None:
+            return error("auth_required", 401)
+        fields = selected_fields(CART_FIELDS, CART_FIELDS)
+        doc = db.carritos.find_one({"cliente_id": user_id}, {f: 1 for f in fields})
+        if doc is not None and "cantidad_items" not in doc and {"subtotal", "cantidad_items"} & set(fields):
+            # Cart written before running totals were stored
+            doc = get_cart(db.carritos, user_id)
+        if doc is None:
+            return json_response({"data": {"items": [], "subtotal": 0, "cantidad_items": 0}})
+        return json_response({"data": {f: doc[f] for f in fields if f in doc}})
+
+    @api.route("/cart/items", methods=["POST"])
+    def cart_add():
+        user_id = _current_user_id()
+        if user_id is None:
+            return error("auth_required", 401)
+        body = request.get_json(silent=True) or {}
+        oid = _object_id(body.get("producto_id"))
+        try:
+            cantidad = int(body.get("cantidad", 1))
+        except (TypeError, ValueError):
+            cantidad = 0
+        if oid is None or cantidad < 1:
+            return error("invalid_request", 400)
+
+        product = db.productos.find_one({"_id": oid, "visible": True}, CART_PRODUCT_PROJECTION)
+        if product is None:
+            return error("product_not_found", 404)
+        return json_response({"data": add_item(db.carritos, user_id, product, cantidad)}, 201)
+
+    @api.route("/cart/items/<product_id>", methods=["DELETE"])
+    def cart_remove(product_id):
+        user_id = _current_user_id()
+        if user_id is None:
+            return error("auth_required", 401)
+        oid = _object_id(product_id)
+        if oid is None:
+            return error("invalid_request", 400)
+        summary = remove_item(db.carritos, user_id, oid)
+        return json_response({"data": summary or {"subtotal": 0, "cantidad_items": 0}})
+
+    # --- Orders ---
+
+    @api.route("/orders")
+    def orders():
+        user_id = _current_user_id()
+        if user_id is None:
+            return error("auth_required", 401)
+        fields = selected_fields(ORDER_FIELDS, ORDER_DEFAULT_FIELDS)
+        page_size = parse_page_size(request.args.get("per_page"), API_MAX_PAGE_SIZE)
+
+        # Newest first over the {usuario_id, fecha_pedido, _id} index
+        filtro = {"usuario_id": user_id}
+        after = decode_cursor(request.args.get("after"))
+        if after:
+            filtro.update(keyset_filter("fecha_pedido", -1, after))
+        projection = {f: 1 for f in fields}
+        projection["fecha_pedido"] = 1
+        cursor = db.pedidos.find(filtro, projection) \
+            .sort([("fecha_pedido", -1), ("_id", -1)]).limit(page_size + 1)
+
+        return stream_page(cursor, page_size, _shape(fields),
+                           lambda last: encode_cursor(last, "fecha_pedido"))
+
+    @api.route("/orders/<order_id>")
+    def order(order_id):
+        user_id = _current_user_id()
+        if user_id is None:
+            return error("auth_required", 401)
+        oid = _object_id(order_id)
+        fields = selected_fields(ORDER_FIELDS, ORDER_FIELDS)
+        projection = {f: 1 for f in fields}
+        projection["usuario_id"] = 1
+        doc = db.pedidos.find_one({"_id": oid}, projection) if oid else None
+        if doc is None or (doc.get("usuario_id") != user_id and session["user"].get("role") != "admin"):
+            return error("order_not_found", 404)
+        return json_response({"data": _shape(fields)(doc)})
+
+    return api
@@ -0,0 +1,260 @@
+"""
+ASGI serving mode.
+
+    pip install quart motor asgiref hypercorn
+    hypercorn asgi:app --workers 4
+
+The read-heavy routes below are served by an async Quart app on the Motor
+driver, running independent queries concurrently with asyncio.gather. Every
+other URL is forwarded to the regular Flask app (main.app) through asgiref's
+WSGI adapter, so URLs, templates, sessions and in-process caches are shared
+with the WSGI mode.
+"""
+import asyncio
+from asgiref.wsgi import WsgiToAsgi
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from quart import Quart, render_template, request, redirect, session, flash, url_for
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+
+import assets
+import main
+import recommendations
+import reviews
+import rollups
+from catalog import ListingQuery, encode_cursor, prefix_filter, AUTOCOMPLETE_MIN_LENGTH, AUTOCOMPLETE_LIMIT
+from database import (MONGO_URI, DB_NAME, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE,
+                      MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_CONNECT_TIMEOUT_MS)
+from instrumentation import command_listener
+from sessions import MongoSessionInterface
+
+quart_app = Quart(__name__)
+quart_app.secret_key = main.app.secret_key
+
+# URLs of routes that only the Flask app serves (fingerprinted assets, review endpoints)
+_flask_urls = main.app.url_map.bind("localhost")
+
+
+def asset_url(endpoint, **values):
+    """
+    assets.asset_url for templates rendered by Quart: /assets/ is served by
+    the Flask app, so its URLs are built from the Flask URL map.
+    """
+    if endpoint == "static":
+        hashed = assets.fingerprinted_name(values.get("filename"))
+        if hashed:
+            return _flask_urls.build("fingerprinted_asset", {"filename": hashed})
+    return url_for(endpoint, **values)
+
+
+quart_app.jinja_env.globals["asset_url"] = asset_url
+
+_motor_client = None
+
+
+def motor_db():
+    """
+    Motor database on a client created lazily inside the running event loop.
+    """
+    global _motor_client
+    if _motor_client is None:
+        _motor_client = AsyncIOMotorClient(
+            MONGO_URI,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+            event_listeners=[command_listener],
+        )
+    return _motor_client[DB_NAME]
+
+
+class AsyncMongoSessionInterface(MongoSessionInterface):
+    """
+    Same session documents and cookie as the Flask app, read and written with Motor.
+    """
+
+    @property
+    def collection(self):
+        return motor_db()[self.collection_name]
+
+    async def open_session(self, app, request):
+        sid = self._session_id(app, request)
+        doc = await self.collection.find_one(self._lookup(sid)) if sid else None
+        return self._from_doc(sid, doc)
+
+    async def save_session(self, app, session, response):
+        if session.previous_sid:
+            await self.collection.delete_one({"_id": session.previous_sid})
+        plan = self._write_plan(session)
+        if plan is None:
+            return
+        action, payload = plan
+        if action == "delete":
+            await self.collection.delete_one({"_id": session.sid})
+            self._apply_cookie(app, session, response, action)
+            return
+        expira, update = payload
+        await self.collection.update_one({"_id": session.sid}, update, upsert=True)
+        self._apply_cookie(app, session, response, action, expira)
+
+
+quart_app.session_interface = AsyncMongoSessionInterface(None)
+
+
+async def fresh_category_tree():
+    """
+    The cached tree refreshes itself with a blocking query once per TTL;
+    touching it in a worker thread keeps that off the event loop.
+    """
+    await asyncio.to_thread(main.category_tree.all)
+    return main.category_tree
+
+
+@quart_app.before_request
+async def start_cache_bus():
+    # Same bus as the Flask routes: it invalidates the caches shared through `main`
+    main.cache_bus.start()
+
+
+# --- Routes ---
+
+@quart_app.route('/health')
+async def health():
+    try:
+        await motor_db().command('ping')
+    except Exception:
+        return {"status": "unavailable"}, 503
+    return {"status": "ok"}
+
+@quart_app.route('/')
+async def index():
+    tree = await fresh_category_tree()
+    listing = ListingQuery(request.args, tree)
+    cursor = listing.apply(motor_db().productos.find(listing.filter, listing.projection))
+    products, next_args = listing.paginate(await cursor.to_list(None), request.args)
+    next_url = url_for('index', **next_args) if next_args else None
+
+    return await render_template('index.html', products=products, categories=tree.top_level(),
+                                 sort_option=listing.sort_option, next_url=next_url)
+
+@quart_app.route('/search/suggest')
+async def search_suggest():
+    query = (request.args.get('q') or '').strip()
+    prefix = prefix_filter(query) if len(query) >= AUTOCOMPLETE_MIN_LENGTH else None
+    if not prefix:
+        return {"suggestions": []}
+    prefix["visible"] = True
+
+    cursor = motor_db().productos.find(prefix, {"nombre": 1}).sort("nombre_normalizado", 1)
+    docs = await cursor.to_list(AUTOCOMPLETE_LIMIT)
+    return {"suggestions": [{"id": str(p['_id']), "nombre": p['nombre']} for p in docs]}
+
+@quart_app.route('/product/<product_id>')
+async def product_details(product_id):
+    recommendations.start_background_refresh(main.db)
+
+    # The version read may query counters: keep it off the event loop
+    cached, recs_version = await asyncio.to_thread(main.get_product_page, product_id)
+    if cached is None:
+        mdb = motor_db()
+        oid = ObjectId(product_id)
+        # The precomputed list and the first page of reviews only depend on
+        # the id: fetch them alongside the product
+        product, rec_doc, page = await asyncio.gather(
+            mdb.productos.find_one({"_id": oid}, main.PRODUCT_DETAIL_PROJECTION),
+            mdb[recommendations.RECOMMENDATIONS_COLLECTION].find_one(
+                {"_id": oid}, recommendations.RECOMMENDATION_DOC_PROJECTION),
+            mdb[reviews.REVIEWS_COLLECTION].find({"producto_id": oid}, reviews.REVIEW_PROJECTION)
+                .sort([("fecha", -1), ("_id", -1)]).to_list(reviews.REVIEW_PAGE_SIZE + 1)
+        )
+        if not product:
+            await flash('Producto no encontrado', 'error')
+            return redirect('/')
+
+        recs = []
+        ids = recommendations.candidate_ids(rec_doc)
+        if ids:
+            current = await mdb.productos.find(recommendations.current_filter(ids),
+                                               recommendations.RECOMMENDATION_PROJECTION).to_list(None)
+            recs = recommendations.in_order(ids, current)
+        if not recs:
+            fallback = recommendations.fallback_filter(product)
+            recs = await mdb.productos.find(fallback, recommendations.RECOMMENDATION_PROJECTION) \
+                .to_list(recommendations.RECOMMENDATION_LIMIT) if fallback else []
+        # Same shape as reviews.get_reviews()
+        reviews_next = encode_cursor(page[reviews.REVIEW_PAGE_SIZE - 1], "fecha") \
+            if len(page) > reviews.REVIEW_PAGE_SIZE else None
+        cached = (product, recs, page[:reviews.REVIEW_PAGE_SIZE], reviews_next)
+        main.product_page_cache.set(product_id, (*cached, recs_version))
+
+    product, recs, product_reviews, reviews_next = cached
+    return await render_template('product_details.html', product=product, recommendations=recs,
+                                 reviews=product_reviews, reviews_next=reviews_next,
+                                 reviews_url=_flask_urls.build("product_reviews", {"product_id": product_id}))
+
+@quart_app.route('/admin/analytics')
+async def admin_analytics():
+    if 'user' not in session or session['user']['role'] != 'admin':
+        await flash('Acceso denegado. Se requieren permisos de administrador.', 'error')
+        return redirect('/')
+
+    mdb = motor_db()
+    totals, num_customers, top_aggr, cat_row, month_aggr, tree = await asyncio.gather(
+        mdb[rollups.PERIODOS].find_one({"_id": "total"}),
+        mdb.usuarios.count_documents({"role": "customer"}),
+        mdb[rollups.PRODUCTOS].aggregate(rollups.top_products_pipeline(5)).to_list(None),
+        mdb[rollups.CATEGORIAS].find_one(sort=[("revenue", -1)]),
+        mdb[rollups.PERIODOS].find({"periodo": "mes"}, {"total": 1}).sort("_id", 1).to_list(None),
+        fresh_category_tree()
+    )
+
+    top_products = [{
+        "_id": str(row['_id']),
+        "nombre": row.get('nombre') or 'Desconocido',
+        "quantity": int(row.get('quantity', 0)),
+        "revenue": int(row.get('revenue', 0))
+    } for row in top_aggr]
+
+    top_category = None
+    if cat_row:
+        cat_doc = tree.get(cat_row['_id'])
+        top_category = {
+            "_id": str(cat_row['_id']) if cat_row.get('_id') else None,
+            "nombre": cat_doc['nombre'] if cat_doc else 'Desconocida',
+            "quantity": int(cat_row.get('quantity', 0)),
+            "revenue": int(cat_row.get('revenue', 0))
+        }
+
+    return await render_template('analytics.html',
+                                 total_sales=(totals or {}).get('total', 0),
+                                 num_customers=num_customers,
+                                 top_products=top_products,
+                                 best_product=top_products[0] if top_products else None,
+                                 top_category=top_category,
+                                 sales_by_month=[{"month": m['_id'], "total": int(m['total'])} for m in month_aggr])
+
+
+# --- Dispatcher ---
+
+flask_asgi = WsgiToAsgi(main.app)
+_quart_urls = quart_app.url_map.bind("localhost")
+
+
+def _served_by_quart(scope):
+    try:
+        _quart_urls.match(scope["path"], method=scope["method"])
+    except (HTTPException, RequestRedirect):
+        return False
+    return True
+
+
+async def app(scope, receive, send):
+    """
+    ASGI entry point: async routes go to Quart, everything else to Flask.
+    """
+    if scope["type"] == "http" and not _served_by_quart(scope):
+        await flask_asgi(scope, receive, send)
+    else:
+        await quart_app(scope, receive, send)
@@ -0,0 +1,192 @@
+"""
+Static asset pipeline and response compression.
+
+    python assets.py build     # fingerprint + precompress static/ into static/dist/
+
+Templates call asset_url('static', filename='css/style.css'), which returns
+the fingerprinted /assets/... URL once a build exists and falls back to the
+plain static URL otherwise. Fingerprinted files never change, so they are
+served with a one-year immutable Cache-Control, picking the .br or .gz
+variant the client accepts.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+from flask import abort, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip variants are built and served
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_PATH = os.path.join(DIST_DIR, "manifest.json")
+
+# Asset types worth precompressing
+COMPRESSIBLE = (".css", ".js", ".svg", ".json", ".txt", ".html")
+# Rendered HTML smaller than this is sent uncompressed
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Content-Encoding -> suffix of the precompressed file, in order of preference
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+# --- Build ---
+
+def _fingerprinted_name(relpath, content):
+    root, ext = os.path.splitext(relpath)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+
+
+def build(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """
+    Copies every file under static/ to static/dist/ with a content hash in
+    its name, writes .gz (and .br when brotli is installed) next to the
+    compressible ones and records original -> hashed names in manifest.json.
+    """
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dist_dir]
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            relpath = os.path.relpath(source, static_dir).replace(os.sep, "/")
+            with open(source, "rb") as f:
+                content = f.read()
+
+            hashed = _fingerprinted_name(relpath, content)
+            target = os.path.join(dist_dir, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, "wb") as f:
+                f.write(content)
+
+            if name.endswith(COMPRESSIBLE):
+                # mtime=0 keeps the .gz output byte-identical across builds
+                with open(target + ".gz", "wb") as f:
+                    f.write(gzip.compress(content, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(target + ".br", "wb") as f:
+                        f.write(brotli.compress(content, quality=11))
+            manifest[relpath] = hashed
+            print(f"  {relpath} -> {hashed}")
+
+    os.makedirs(dist_dir, exist_ok=True)
+    with open(os.path.join(dist_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(path=MANIFEST_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# --- Serving ---
+
+_manifest = load_manifest()
+_fingerprinted = set(_manifest.values())
+
+
+def fingerprinted_name(filename):
+    """
+    Hashed name of a static file in the build manifest, or None.
+    """
+    return _manifest.get(filename)
+
+
+def asset_url(endpoint, **values):
+    """
+    Drop-in for url_for in templates: static files that are in the build
+    manifest resolve to their fingerprinted /assets/ URL.
+    """
+    if endpoint == "static":
+        hashed = fingerprinted_name(values.get("filename"))
+        if hashed:
+            values["filename"] = hashed
+            return url_for("fingerprinted_asset", **values)
+    return url_for(endpoint, **values)
+
+
+def _preferred_encoding(candidates):
+    """
+    Best encoding among `candidates` that the client accepts, or None.
+    """
+    accepted = request.accept_encodings
+    for encoding in candidates:
+        if accepted[encoding]:
+            return encoding
+    return None
+
+
+def serve_asset(filename):
+    if filename not in _fingerprinted:
+        abort(404)
+    available = [enc for enc, suffix in ENCODING_SUFFIXES.items()
+                 if os.path.exists(os.path.join(DIST_DIR, filename + suffix))]
+    encoding = _preferred_encoding(available)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    path = filename + ENCODING_SUFFIXES[encoding] if encoding else filename
+    response = send_from_directory(DIST_DIR, path, mimetype=mimetype)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def _compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def init_app(app):
+    """
+    Registers the /assets/ route, the asset_url template helper and
+    on-the-fly compression of rendered HTML.
+    """
+    app.add_url_rule("/assets/<path:filename>", "fingerprinted_asset", serve_asset)
+    app.jinja_env.globals["asset_url"] = asset_url
+
+    @app.after_request
+    def _compress_html(response):
+        if (response.status_code != 200 or response.mimetype != "text/html"
+                or response.direct_passthrough or response.is_streamed
+                or "Content-Encoding" in response.headers):
+            return response
+        response.vary.add("Accept-Encoding")
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        encoding = _preferred_encoding(["br", "gzip"] if brotli is not None else ["gzip"])
+        if encoding is None:
+            return response
+
+        response.set_data(_compress(data, encoding))
+        response.headers["Content-Encoding"] = encoding
+        # A strong ETag must differ per representation (see httpcache.ETAG_ENCODING_SUFFIXES)
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}-{encoding}", weak)
+        return response
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Pipeline de recursos estáticos.")
+    parser.add_argument("command", choices=["build"])
+    parser.parse_args()
+    manifest = build()
+    print(f"{len(manifest)} recursos en {DIST_DIR}" + ("" if brotli else " (sin brotli: solo .gz)"))
@@ -0,0 +1,316 @@
+"""
+End-to-end benchmarks for the storefront and admin routes.
+
+Seeds a throwaway database at one or more data sizes, drives the routes
+through the Flask test client and then concurrently over HTTP, and reports
+throughput, latency percentiles and Mongo round-trips per request.
+
+    python benchmarks/bench_routes.py --sizes small,medium
+    python benchmarks/bench_routes.py --sizes small --save-baseline
+    python benchmarks/bench_routes.py --sizes small --skip-seed --compare
+
+Runs against MONGO_DB_NAME (default 'tienda_bench'), which is dropped and
+re-created when seeding. Never point it at a database you care about.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+
+os.environ.setdefault("MONGO_DB_NAME", "tienda_bench")
+# Background refreshers would add noise to the measurements
+os.environ.setdefault("RECOMMENDATIONS_REFRESH_SECONDS", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bson.objectid import ObjectId  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+import init_db  # noqa: E402
+import main  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# Data sizes: synthetic_data.load() options
+SIZES = {
+    "small": {"products": 10000, "users": 1000, "orders": 50000},
+    "medium": {"products": 100000, "users": 10000, "orders": 500000},
+    "large": {"products": 1000000, "users": 100000, "orders": 5000000},
+}
+
+CUSTOMER = ("cliente0@example.com", "user123")
+ADMIN = ("admin@tienda.com", "admin123")
+
+# Stock given to the sample product before every scenario, so checkouts never
+# hit the out-of-stock redirect, whatever the seeded stock or earlier runs
+RESTOCK_UNITS = 10000000
+# Redirect a scenario must answer with to count as measured (anything else is reported)
+EXPECTED_REDIRECTS = {"checkout": "/order/", "add_to_cart": "/cart"}
+
+
+def restock(sample_product):
+    main.db.productos.update_one({"_id": ObjectId(sample_product)},
+                                 {"$set": {"stock": RESTOCK_UNITS, "bajo_stock": False}})
+
+
+def check_redirect(name, status, location, unexpected):
+    """
+    Counts responses of redirecting scenarios that did not go where they should
+    (e.g. checkout sent back to /cart).
+    """
+    expected = EXPECTED_REDIRECTS.get(name)
+    if expected and not (300 <= status < 400 and expected in (location or "")):
+        unexpected[name] = unexpected.get(name, 0) + 1
+
+
+def report_unexpected(mode, unexpected):
+    for name, count in unexpected.items():
+        print(f"Warning: {mode}/{name}: {count} responses did not redirect to "
+              f"{EXPECTED_REDIRECTS[name]}; those timings measure a different path")
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies_ms, roundtrips, elapsed):
+    return {
+        "requests": len(latencies_ms),
+        "throughput_rps": round(len(latencies_ms) / elapsed, 1) if elapsed > 0 else 0,
+        "p50_ms": round(percentile(latencies_ms, 0.50), 2),
+        "p95_ms": round(percentile(latencies_ms, 0.95), 2),
+        "p99_ms": round(percentile(latencies_ms, 0.99), 2),
+        "roundtrips": round(sum(roundtrips) / len(roundtrips), 2) if roundtrips else 0,
+    }
+
+
+def scenarios(sample_product):
+    """
+    (name, login, method, path, form) for every benchmarked request.
+    `add_checkout` adds an item first so each checkout has something to buy.
+    """
+    return [
+        ("index", None, "GET", "/", None),
+        ("index_search", None, "GET", "/?q=laptop", None),
+        ("index_prefix", None, "GET", "/?q=lap&mode=prefix", None),
+        ("index_category", None, "GET", "/?category=tecnologia", None),
+        ("index_sorted", None, "GET", "/?sort=price_asc&per_page=24", None),
+        ("product_details", None, "GET", f"/product/{sample_product}", None),
+        ("add_to_cart", CUSTOMER, "GET", f"/cart/add/{sample_product}", None),
+        ("cart", CUSTOMER, "GET", "/cart", None),
+        ("cart_summary", CUSTOMER, "GET", "/cart/summary", None),
+        ("api_products", None, "GET", "/api/v1/products?per_page=100&fields=nombre,precio", None),
+        ("api_cart", CUSTOMER, "GET", "/api/v1/cart?fields=subtotal,cantidad_items", None),
+        ("api_orders", CUSTOMER, "GET", "/api/v1/orders", None),
+        ("checkout", CUSTOMER, "POST", "/checkout", {}),
+        ("dashboard", CUSTOMER, "GET", "/dashboard", None),
+        ("admin", ADMIN, "GET", "/admin", None),
+        ("admin_analytics", ADMIN, "GET", "/admin/analytics", None),
+    ]
+
+
+def bench_test_client(sample_product, iterations):
+    """
+    Sequential requests through the Flask test client (no network, no server).
+    """
+    clients = {None: main.app.test_client()}
+    for creds in (CUSTOMER, ADMIN):
+        client = main.app.test_client()
+        client.post("/login", data={"email": creds[0], "password": creds[1]})
+        clients[creds] = client
+
+    results, unexpected = {}, {}
+    for name, login, method, path, form in scenarios(sample_product):
+        client = clients[login]
+        restock(sample_product)
+        latencies, roundtrips = [], []
+        started = time.perf_counter()
+        for _ in range(iterations):
+            if name == "checkout":
+                client.get(f"/cart/add/{sample_product}")
+            t0 = time.perf_counter()
+            response = client.open(path, method=method, data=form)
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+            roundtrips.append(int(response.headers.get("X-DB-Roundtrips", 0)))
+            check_redirect(name, response.status_code, response.headers.get("Location"), unexpected)
+        results[name] = summarize(latencies, roundtrips, time.perf_counter() - started)
+    report_unexpected("test_client", unexpected)
+    return results
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """
+    Returns 3xx responses as they are, like the test client: the timing and
+    X-DB-Roundtrips then belong to the route measured, not to the redirect target.
+    """
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def fetch(opener, url, data=None):
+    """
+    (status, headers) of a request; 3xx and 4xx responses arrive as HTTPError.
+    """
+    try:
+        with opener.open(url, data=data) as response:
+            response.read()
+            return response.status, response.headers
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code, e.headers
+
+
+def bench_http(sample_product, concurrency, requests_per_worker):
+    """
+    Concurrent load over real HTTP against a threaded werkzeug server.
+    Each worker keeps its own cookie jar (one logged-in session per worker).
+    """
+    server = make_server("127.0.0.1", 0, main.app, threaded=True)
+    base = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def opener_for(login):
+        # The cookie processor runs before the error processor, so the session
+        # cookie of the login redirect is kept
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect())
+        if login:
+            data = urllib.parse.urlencode({"email": login[0], "password": login[1]}).encode()
+            fetch(opener, base + "/login", data=data)
+        return opener
+
+    unexpected = {}
+    unexpected_lock = threading.Lock()
+
+    def worker(name, login, method, path, form):
+        opener = opener_for(login)
+        latencies, roundtrips, missed = [], [], {}
+        for _ in range(requests_per_worker):
+            if name == "checkout":
+                fetch(opener, f"{base}/cart/add/{sample_product}")
+            data = urllib.parse.urlencode(form).encode() if method == "POST" else None
+            t0 = time.perf_counter()
+            status, headers = fetch(opener, base + path, data=data)
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+            roundtrips.append(int(headers.get("X-DB-Roundtrips", 0)))
+            check_redirect(name, status, headers.get("Location"), missed)
+        with unexpected_lock:
+            for key, count in missed.items():
+                unexpected[key] = unexpected.get(key, 0) + count
+        return latencies, roundtrips
+
+    results = {}
+    try:
+        for scenario in scenarios(sample_product):
+            restock(sample_product)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(lambda _: worker(*scenario), range(concurrency)))
+            elapsed = time.perf_counter() - started
+            latencies = [x for lat, _ in outcomes for x in lat]
+            roundtrips = [x for _, rt in outcomes for x in rt]
+            results[scenario[0]] = summarize(latencies, roundtrips, elapsed)
+    finally:
+        server.shutdown()
+    report_unexpected("http", unexpected)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns regression messages: p95 slower than baseline by more than
+    `tolerance` (fraction), or more Mongo round-trips than the baseline.
+    """
+    failures = []
+    for size, modes in results.items():
+        for mode, routes in modes.items():
+            for route, stats in routes.items():
+                base = baseline.get(size, {}).get(mode, {}).get(route)
+                if not base:
+                    continue
+                if stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                    failures.append(f"{size}/{mode}/{route}: p95 {stats['p95_ms']}ms > baseline {base['p95_ms']}ms")
+                if stats["roundtrips"] > base["roundtrips"]:
+                    failures.append(f"{size}/{mode}/{route}: {stats['roundtrips']} round-trips > baseline {base['roundtrips']}")
+    return failures
+
+
+def print_table(size, mode, routes):
+    print(f"\n[{size}] {mode}")
+    print(f"{'route':<22}{'req':>7}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'db rt':>7}")
+    for route, s in routes.items():
+        print(f"{route:<22}{s['requests']:>7}{s['throughput_rps']:>9}{s['p50_ms']:>9}"
+              f"{s['p95_ms']:>9}{s['p99_ms']:>9}{s['roundtrips']:>7}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="small", help="Comma-separated: " + ", ".join(SIZES))
+    parser.add_argument("--iterations", type=int, default=50, help="Test-client requests per route")
+    parser.add_argument("--concurrency", type=int, default=8, help="HTTP load generator workers")
+    parser.add_argument("--requests", type=int, default=25, help="HTTP requests per worker and route")
+    parser.add_argument("--workers", type=int, default=4, help="Seeding processes")
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse the data already loaded")
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true", help="Fail on regressions against baselines.json")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p95 slowdown (fraction)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for size in [s.strip() for s in args.sizes.split(",") if s.strip()]:
+        if not args.skip_seed:
+            print(f"Seeding '{size}' into {os.environ['MONGO_DB_NAME']}...")
+            init_db.init_db(synthetic=dict(SIZES[size], workers=args.workers))
+            main.category_tree.invalidate()
+            main.product_page_cache.clear()
+
+        # Best-stocked product; restock() tops it up before every scenario anyway
+        sample = main.db.productos.find_one({"visible": True}, {"_id": 1}, sort=[("stock", -1)])
+        sample_product = str(sample["_id"])
+
+        results[size] = {"test_client": bench_test_client(sample_product, args.iterations)}
+        print_table(size, "test_client", results[size]["test_client"])
+        if not args.skip_http:
+            results[size]["http"] = bench_http(sample_product, args.concurrency, args.requests)
+            print_table(size, "http", results[size]["http"])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {BASELINE_PATH}")
+
+    if args.compare:
+        if not os.path.exists(BASELINE_PATH):
+            print("No baselines.json yet: run with --save-baseline first.")
+            sys.exit(2)
+        with open(BASELINE_PATH) as f:
+            failures = compare(results, json.load(f), args.tolerance)
+        if failures:
+            print("\nRegressions:")
+            for failure in failures:
+                print("  " + failure)
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,134 @@
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# Fields needed to snapshot a product into a cart line
+CART_PRODUCT_PROJECTION = {"nombre": 1, "sku": 1, "precio": 1, "categoria.id": 1}
+
+# Running totals kept on the cart document (header badge, /cart/summary)
+CART_SUMMARY_PROJECTION = {"_id": 0, "subtotal": 1, "cantidad_items": 1}
+
+
+def cart_line(product, cantidad=1):
+    return {
+        "producto_id": product['_id'],
+        "nombre": product['nombre'],
+        "sku": product.get('sku', ''),
+        "cantidad": cantidad,
+        "precio_unitario": product['precio'],
+        "total_linea": product['precio'] * cantidad,
+        "categoria_id": product.get('categoria', {}).get('id'),
+        "atributos": {}
+    }
+
+
+def _totals_stages():
+    """
+    Pipeline stages that recompute every line total, the subtotal and the
+    item count from `items`. Appended to each cart write so the stored
+    totals always match the lines, atomically with the change itself.
+    """
+    return [
+        {"$set": {"items": {"$map": {
+            "input": {"$ifNull": ["$items", []]},
+            "as": "it",
+            "in": {"$mergeObjects": ["$$it", {"total_linea": {"$multiply": ["$$it.precio_unitario", "$$it.cantidad"]}}]}
+        }}}},
+        {"$set": {
+            "subtotal": {"$sum": "$items.total_linea"},
+            "cantidad_items": {"$sum": "$items.cantidad"},
+            "fecha_actualizacion": "$$NOW"
+        }}
+    ]
+
+
+def _add_item_pipeline(line):
+    """
+    Aggregation-pipeline update that increments the line for this product if
+    it is already in the cart and appends it otherwise. Missing fields are
+    initialised, so the same pipeline also builds a brand-new cart on upsert.
+    """
+    pid = line['producto_id']
+    items = {"$ifNull": ["$items", []]}
+    return [
+        {"$set": {
+            "items": {"$cond": [
+                {"$in": [pid, {"$map": {"input": items, "as": "it", "in": "$$it.producto_id"}}]},
+                {"$map": {
+                    "input": items,
+                    "as": "it",
+                    "in": {"$cond": [
+                        {"$eq": ["$$it.producto_id", pid]},
+                        {"$mergeObjects": ["$$it", {"cantidad": {"$add": ["$$it.cantidad", line['cantidad']]}}]},
+                        "$$it"
+                    ]}
+                }},
+                # $literal keeps user-entered strings (e.g. names starting with "$") from being read as paths
+                {"$concatArrays": [items, [{"$literal": line}]]}
+            ]},
+            "descuentos": {"$ifNull": ["$descuentos", []]}
+        }}
+    ] + _totals_stages()
+
+
+def add_item(carritos, user_id, product, cantidad=1):
+    """
+    Adds `cantidad` units of `product` to the user's cart in a single atomic
+    upsert. The unique index on carritos.cliente_id guarantees one cart per
+    user; if two first-time adds race, the loser retries as a plain update.
+    Returns the cart summary (subtotal, cantidad_items) after the write.
+    """
+    pipeline = _add_item_pipeline(cart_line(product, cantidad))
+    try:
+        return _update_cart(carritos, user_id, pipeline, upsert=True)
+    except DuplicateKeyError:
+        return _update_cart(carritos, user_id, pipeline, upsert=True)
+
+
+def remove_item(carritos, user_id, product_id):
+    """
+    Drops the product's line and refreshes the totals in one update.
+    Returns the cart summary, or None if the user has no cart.
+    """
+    pipeline = [
+        {"$set": {"items": {"$filter": {
+            "input": {"$ifNull": ["$items", []]},
+            "as": "it",
+            "cond": {"$ne": ["$$it.producto_id", product_id]}
+        }}}}
+    ] + _totals_stages()
+    return _update_cart(carritos, user_id, pipeline)
+
+
+def refresh_totals(carritos, user_id):
+    """
+    Recomputes the totals of a cart written before they were stored.
+    Returns the full cart document.
+    """
+    return carritos.find_one_and_update({"cliente_id": user_id}, _totals_stages(),
+                                        return_document=ReturnDocument.AFTER)
+
+
+def get_cart(carritos, user_id):
+    """
+    The user's cart with its stored totals (None if there is no cart).
+    """
+    cart = carritos.find_one({"cliente_id": user_id})
+    if cart is not None and "cantidad_items" not in cart:
+        cart = refresh_totals(carritos, user_id)
+    return cart
+
+
+def cart_summary(carritos, user_id):
+    """
+    Just the running totals, read through a projection.
+    """
+    summary = carritos.find_one({"cliente_id": user_id}, CART_SUMMARY_PROJECTION)
+    if summary is not None and "cantidad_items" not in summary:
+        summary = refresh_totals(carritos, user_id)
+    summary = summary or {}
+    return {"subtotal": summary.get('subtotal', 0), "cantidad_items": summary.get('cantidad_items', 0)}
+
+
+def _update_cart(carritos, user_id, pipeline, upsert=False):
+    return carritos.find_one_and_update({"cliente_id": user_id}, pipeline, CART_SUMMARY_PROJECTION,
+                                        upsert=upsert, return_document=ReturnDocument.AFTER)
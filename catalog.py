@@ -0,0 +1,354 @@
+import base64
+import os
+import re
+import threading
+import time
+import unicodedata
+from bson import json_util
+from bson.errors import BSONError
+from pymongo import ReturnDocument
+
+# Name of the full-text index over productos (see init_db.py)
+TEXT_INDEX_NAME = "productos_text"
+TEXT_INDEX_LANGUAGE = "spanish"
+
+# Autocomplete settings
+AUTOCOMPLETE_MIN_LENGTH = 2
+AUTOCOMPLETE_LIMIT = 8
+
+
+def normalize_text(value):
+    """
+    Lowercases and strips accents so "Camión" and "camion" compare equal.
+    Stored on products as `nombre_normalizado` for index-friendly prefix search.
+    """
+    if not value:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", value)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(stripped.lower().split())
+
+
+def text_search_filter(query):
+    """
+    Ranked full-text search backed by the productos text index.
+    The text index (version 3) is diacritic-insensitive and applies Spanish stemming.
+    """
+    return {"$text": {"$search": query, "$language": TEXT_INDEX_LANGUAGE}}
+
+
+# Projection/sort pair used to rank $text results by relevance
+TEXT_SCORE_PROJECTION = {"score": {"$meta": "textScore"}}
+TEXT_SCORE_SORT = [("score", {"$meta": "textScore"})]
+
+
+def prefix_filter(query):
+    """
+    Anchored, case-sensitive regex over the normalized name. Unlike the old
+    unanchored IGNORECASE regex this can walk the `nombre_normalizado` index.
+    """
+    prefix = normalize_text(query)
+    if not prefix:
+        return None
+    return {"nombre_normalizado": {"$regex": "^" + re.escape(prefix)}}
+
+
+# --- Storefront listing / pagination ---
+
+DEFAULT_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "24"))
+MAX_PAGE_SIZE = 100
+
+# sort option -> (field, direction); _id is always appended as tie-breaker
+SORT_OPTIONS = {
+    "newest": ("fecha_creacion", -1),
+    "price_asc": ("precio", 1),
+    "price_desc": ("precio", -1),
+    "name": ("nombre_normalizado", 1),
+    "rating": ("rating_avg", -1),
+}
+DEFAULT_SORT = "newest"
+
+# Only the fields the product card in index.html renders
+PRODUCT_CARD_PROJECTION = {
+    "nombre": 1,
+    "precio": 1,
+    "moneda": 1,
+    "descripcion": 1,
+    "categoria.nombre": 1,
+    "imagenes": {"$slice": 1},
+    "rating_avg": 1,
+    "rating_count": 1,
+}
+
+
+def parse_page_size(value, maximum=MAX_PAGE_SIZE):
+    """
+    Clamps the requested page size to [1, maximum].
+    """
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(size, maximum))
+
+
+def encode_cursor(doc, sort_field):
+    """
+    Opaque keyset cursor holding the sort value and _id of the last row shown.
+    """
+    payload = json_util.dumps([doc.get(sort_field), doc["_id"]])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """
+    Inverse of encode_cursor. Returns (sort_value, _id) or None if malformed.
+    """
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        value, last_id = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, TypeError, BSONError):
+        # Includes crafted extended JSON such as {"$oid": "zz"} (InvalidId)
+        return None
+    if isinstance(value, (dict, list)):
+        # A document here would be read as query operators by keyset_filter
+        return None
+    return value, last_id
+
+
+def keyset_filter(sort_field, direction, cursor):
+    """
+    Filter selecting rows strictly after `cursor` in (sort_field, _id) order.
+    """
+    value, last_id = cursor
+    op = "$gt" if direction == 1 else "$lt"
+    return {"$or": [
+        {sort_field: {op: value}},
+        {sort_field: value, "_id": {op: last_id}},
+    ]}
+
+
+
+class ListingQuery:
+    """
+    Storefront listing built from the index() query-string arguments:
+    search (text or prefix), category and minimum-rating filters, sort option
+    and pagination.
+    Shared by the WSGI and ASGI front ends; apply() works on any chainable
+    cursor (pymongo or motor).
+    """
+
+    def __init__(self, args, category_tree, max_page_size=MAX_PAGE_SIZE):
+        query = (args.get('q') or '').strip()
+        search_mode = args.get('mode', 'text')
+        category_slug = args.get('category')
+        sort_option = args.get('sort')
+        self.page_size = parse_page_size(args.get('per_page'), max_page_size)
+
+        self.filter = {"visible": True}
+        self.projection = dict(PRODUCT_CARD_PROJECTION)
+        self.ranked = False
+
+        if query:
+            if search_mode == 'prefix':
+                # Autocomplete-style: anchored match on the normalized name index
+                prefix = prefix_filter(query)
+                if prefix:
+                    self.filter.update(prefix)
+                    sort_option = sort_option or 'name'
+            else:
+                # Relevance-ranked full-text search on the productos text index
+                self.filter.update(text_search_filter(query))
+                self.ranked = sort_option not in SORT_OPTIONS
+
+        if sort_option not in SORT_OPTIONS:
+            sort_option = DEFAULT_SORT
+        self.sort_option = sort_option
+
+        min_rating = args.get('min_rating', type=float)
+        if min_rating:
+            # Range on rating_avg, served by the (visible, rating_avg, _id) indexes
+            self.filter["rating_avg"] = {"$gte": min_rating}
+
+        if category_slug:
+            # Category ids (including all nested subcategories) come from the cached tree
+            cat = category_tree.get_by_slug(category_slug)
+            if cat:
+                self.filter["categoria.id"] = {"$in": category_tree.descendant_ids(cat['_id'])}
+
+        self.skip = 0
+        if self.ranked:
+            # textScore is computed per query, so relevance order pages by offset
+            self.page = max(1, args.get('page', 1, type=int))
+            self.skip = (self.page - 1) * self.page_size
+            self.projection.update(TEXT_SCORE_PROJECTION)
+            self.sort = TEXT_SCORE_SORT
+        else:
+            # Keyset pagination on (sort key, _id): cost is independent of page depth
+            self.sort_field, direction = SORT_OPTIONS[sort_option]
+            self.projection[self.sort_field] = 1
+            after = decode_cursor(args.get('after'))
+            if after:
+                self.filter.update(keyset_filter(self.sort_field, direction, after))
+            self.sort = [(self.sort_field, direction), ("_id", direction)]
+
+    def apply(self, cursor):
+        # Fetch one extra row to know whether there is a next page
+        if self.skip:
+            cursor = cursor.skip(self.skip)
+        return cursor.sort(self.sort).limit(self.page_size + 1)
+
+    def paginate(self, products, args):
+        """
+        Trims the extra row. Returns (products, next_args), where next_args
+        are the query arguments of the next page or None on the last page.
+        """
+        if len(products) <= self.page_size:
+            return products, None
+        products = products[:self.page_size]
+        next_args = args.to_dict()
+        if self.ranked:
+            next_args['page'] = self.page + 1
+        else:
+            next_args['after'] = encode_cursor(products[-1], self.sort_field)
+        return products, next_args
+
+# --- Catalog version (HTTP validators) ---
+
+CATALOG_VERSION_TTL = float(os.getenv("CATALOG_VERSION_TTL", "1"))
+# Document in the counters collection (see order_numbers.py) holding the version
+CATALOG_VERSION_ID = "catalogo"
+
+
+class CatalogVersion:
+    """
+    Shared catalog version: a counter bumped after every write that changes
+    what catalog pages show (new products, stock, reviews, imports). Each
+    process re-reads it at most once per CATALOG_VERSION_TTL seconds, so
+    validating a page costs no query most of the time.
+    Products also carry their own `version`, incremented by the same writes.
+    `counter_id` selects another counter with the same behaviour (see
+    recommendations.VERSION_ID).
+    """
+
+    def __init__(self, db, ttl=CATALOG_VERSION_TTL, counter_id=CATALOG_VERSION_ID):
+        self.db = db
+        self.ttl = ttl
+        self.counter_id = counter_id
+        self._checked_at = None
+        self._value = (0, None)
+
+    def current(self):
+        """
+        (version, datetime of the last bump or None).
+        """
+        checked_at = self._checked_at
+        if checked_at is None or time.monotonic() - checked_at >= self.ttl:
+            doc = self.db.counters.find_one({"_id": self.counter_id}) or {}
+            self._value = (doc.get('valor', 0), doc.get('fecha'))
+            self._checked_at = time.monotonic()
+        return self._value
+
+    def bump(self):
+        doc = self.db.counters.find_one_and_update(
+            {"_id": self.counter_id},
+            {"$inc": {"valor": 1}, "$currentDate": {"fecha": True}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._value = (doc['valor'], doc.get('fecha'))
+        self._checked_at = time.monotonic()
+        return self._value
+
+    def invalidate(self):
+        """
+        Forces the next current() to re-read the counter.
+        """
+        self._checked_at = None
+
+# --- Category tree cache ---
+
+CATEGORY_CACHE_TTL = float(os.getenv("CATEGORY_CACHE_TTL", "300"))
+
+
+class CategoryTree:
+    """
+    In-process snapshot of the categorias collection.
+    Loaded with a single query and refreshed after CATEGORY_CACHE_TTL seconds
+    or when invalidate() is called after a category write.
+    """
+
+    def __init__(self, db, ttl=CATEGORY_CACHE_TTL):
+        self.db = db
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._all = []
+        self._by_id = {}
+        self._by_slug = {}
+        self._top_level = []
+        self._descendants = {}
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def _load(self):
+        docs = list(self.db.categorias.find({}, {"nombre": 1, "slug": 1, "parent_id": 1}))
+        by_id = {doc['_id']: doc for doc in docs}
+        children = {}
+        for doc in docs:
+            children.setdefault(doc.get('parent_id'), []).append(doc['_id'])
+
+        # Each category maps to itself plus every descendant, at any depth
+        descendants = {}
+        for cat_id in by_id:
+            ids, stack, seen = [], [cat_id], set()
+            while stack:
+                current = stack.pop()
+                if current in seen:
+                    continue
+                seen.add(current)
+                ids.append(current)
+                stack.extend(children.get(current, []))
+            descendants[cat_id] = ids
+
+        self._all = docs
+        self._by_id = by_id
+        self._by_slug = {doc['slug']: doc for doc in docs if doc.get('slug')}
+        self._top_level = [doc for doc in docs if doc.get('parent_id') is None]
+        self._descendants = descendants
+        self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.ttl:
+            return
+        with self._lock:
+            loaded_at = self._loaded_at
+            if loaded_at is None or time.monotonic() - loaded_at >= self.ttl:
+                self._load()
+
+    def all(self):
+        self._ensure_fresh()
+        return self._all
+
+    def top_level(self):
+        self._ensure_fresh()
+        return self._top_level
+
+    def get(self, cat_id):
+        self._ensure_fresh()
+        return self._by_id.get(cat_id)
+
+    def get_by_slug(self, slug):
+        self._ensure_fresh()
+        return self._by_slug.get(slug)
+
+    def descendant_ids(self, cat_id):
+        """
+        The category id followed by all of its descendants' ids.
+        """
+        self._ensure_fresh()
+        return self._descendants.get(cat_id, [cat_id])
@@ -0,0 +1,271 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from datetime import datetime
+from bson import json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from catalog import normalize_text, CategoryTree, CatalogVersion
+from database import get_database
+import inventory
+import recommendations
+from reviews import EMPTY_RATING
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 50
+
+# Columns written by export and accepted by import
+CSV_FIELDS = ["sku", "nombre", "descripcion", "categoria", "precio", "moneda",
+              "stock", "stock_minimo", "visible", "imagenes", "atributos"]
+
+EXPORT_PROJECTION = {"sku": 1, "nombre": 1, "descripcion": 1, "categoria.id": 1, "precio": 1,
+                     "moneda": 1, "stock": 1, "stock_minimo": 1, "visible": 1, "imagenes": 1, "atributos": 1}
+
+
+def iter_rows(stream, fmt):
+    """
+    Yields one row per input line without loading the whole file: a dict for
+    CSV, the raw line for JSON Lines (parsed by row_to_product, so a
+    malformed line only invalidates that row).
+    """
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "jsonl":
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield line
+    else:
+        raise ValueError(f"Formato no soportado: {fmt}")
+
+
+def _as_bool(value, default=True):
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "si", "sí", "yes")
+
+
+def _as_text(value, field):
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        raise ValueError(f"{field} debe ser texto")
+    return value.strip()
+
+
+def _as_int(value, field):
+    """
+    Integer from a CSV string or a JSON number. Booleans and fractional
+    values are rejected instead of being truncated.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"{field} debe ser entero")
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(f"{field} debe ser entero")
+        return int(value)
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            pass
+    raise ValueError(f"{field} debe ser entero")
+
+
+def row_to_product(row, categories):
+    """
+    Validates a raw row and converts it into the productos document fields
+    written by import. `categories` is a CategoryTree used to resolve slugs.
+    Raises ValueError with a readable message on invalid rows.
+    """
+    if isinstance(row, str):
+        row = json.loads(row)
+    if not isinstance(row, dict):
+        raise ValueError("cada línea debe ser un objeto JSON")
+    sku = _as_text(row.get("sku"), "sku")
+    nombre = _as_text(row.get("nombre"), "nombre")
+    if not sku or not nombre:
+        raise ValueError("sku y nombre son obligatorios")
+
+    precio = _as_int(row.get("precio"), "precio")
+    stock = row.get("stock")
+    stock = 0 if stock in (None, "") else _as_int(stock, "stock")
+    if precio < 0 or stock < 0:
+        raise ValueError("precio y stock no pueden ser negativos")
+
+    stock_minimo = row.get("stock_minimo")
+    if stock_minimo not in (None, ""):
+        stock_minimo = _as_int(stock_minimo, "stock_minimo")
+        if stock_minimo < 0:
+            raise ValueError("stock_minimo no puede ser negativo")
+
+    cat = categories.get_by_slug(_as_text(row.get("categoria"), "categoria"))
+    if cat is None:
+        raise ValueError(f"categoría desconocida: {row.get('categoria')!r}")
+
+    imagenes = row.get("imagenes") or []
+    if isinstance(imagenes, str):
+        imagenes = [url for url in imagenes.split("|") if url]
+    atributos = row.get("atributos") or {}
+    if isinstance(atributos, str):
+        atributos = json.loads(atributos)
+    if not isinstance(atributos, dict):
+        raise ValueError("atributos debe ser un objeto JSON")
+
+    product = {
+        "sku": sku,
+        "nombre": nombre,
+        "nombre_normalizado": normalize_text(nombre),
+        "descripcion": row.get("descripcion") or "",
+        "categoria": {"id": cat['_id'], "nombre": cat['nombre']},
+        "precio": precio,
+        "moneda": row.get("moneda") or "USD",
+        "stock": stock,
+        "visible": _as_bool(row.get("visible")),
+        "imagenes": imagenes,
+        "atributos": atributos,
+    }
+    if isinstance(stock_minimo, int):
+        product["stock_minimo"] = stock_minimo
+    return product
+
+
+def import_products(db, stream, fmt="csv", batch_size=DEFAULT_BATCH_SIZE, categories=None):
+    """
+    Streams rows from `stream` into productos as unordered bulk upserts keyed
+    on sku, `batch_size` operations at a time. Returns a summary dict with
+    counts, the first validation/write errors and throughput in rows/sec.
+    """
+    categories = categories or CategoryTree(db)
+    stats = {"rows": 0, "upserted": 0, "modified": 0, "invalid": 0, "failed": 0, "errors": []}
+    started = time.perf_counter()
+    batch, skus = [], []
+
+    def report(line, message):
+        if len(stats["errors"]) < MAX_REPORTED_ERRORS:
+            stats["errors"].append({"fila": line, "error": message})
+
+    def flush():
+        if not batch:
+            return
+        try:
+            result = db.productos.bulk_write(batch, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            result = e.details
+            for err in result.get("writeErrors", []):
+                stats["failed"] += 1
+                report(None, err.get("errmsg"))
+        stats["upserted"] += result.get("nUpserted", 0)
+        stats["modified"] += result.get("nModified", 0)
+        # Stock may have changed: refresh the low-stock flags of this batch
+        inventory.refresh_flags(db.productos, skus, key="sku")
+        batch.clear()
+        skus.clear()
+
+    now = datetime.utcnow()
+    for line, row in enumerate(iter_rows(stream, fmt), start=1):
+        stats["rows"] += 1
+        try:
+            product = row_to_product(row, categories)
+        except (ValueError, json.JSONDecodeError) as e:
+            stats["invalid"] += 1
+            report(line, str(e))
+            continue
+        batch.append(UpdateOne(
+            {"sku": product["sku"]},
+            {"$set": product, "$inc": {"version": 1}, "$currentDate": {"fecha_actualizacion": True},
+             "$setOnInsert": {"fecha_creacion": now, **EMPTY_RATING}},
+            upsert=True
+        ))
+        skus.append(product["sku"])
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    if stats["upserted"] or stats["modified"]:
+        # Invalidates ETags of catalog pages in every worker; prices and
+        # visibility shown in recommendation cards may have changed too
+        CatalogVersion(db).bump()
+        recommendations.bump_version(db)
+
+    elapsed = time.perf_counter() - started
+    stats["seconds"] = round(elapsed, 3)
+    stats["rows_per_sec"] = round(stats["rows"] / elapsed, 1) if elapsed > 0 else stats["rows"]
+    return stats
+
+
+def export_products(db, fmt="csv", batch_size=DEFAULT_BATCH_SIZE, categories=None):
+    """
+    Yields the catalog as CSV or JSON Lines text chunks, reading productos
+    with a batched cursor so memory stays bounded.
+    """
+    categories = categories or CategoryTree(db)
+    cursor = db.productos.find({}, EXPORT_PROJECTION).sort("_id", 1).batch_size(batch_size)
+
+    def slug_of(product):
+        cat = categories.get((product.get("categoria") or {}).get("id"))
+        return cat.get("slug", "") if cat else ""
+
+    if fmt == "jsonl":
+        for product in cursor:
+            row = {field: product.get(field) for field in CSV_FIELDS}
+            row["categoria"] = slug_of(product)
+            yield json_util.dumps(row, ensure_ascii=False) + "\n"
+        return
+
+    if fmt != "csv":
+        raise ValueError(f"Formato no soportado: {fmt}")
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    for n, product in enumerate(cursor, start=1):
+        row = {field: product.get(field, "") for field in CSV_FIELDS}
+        row["categoria"] = slug_of(product)
+        row["imagenes"] = "|".join(product.get("imagenes") or [])
+        row["atributos"] = json.dumps(product.get("atributos") or {}, ensure_ascii=False)
+        writer.writerow(row)
+        if n % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa/exporta el catálogo de productos.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    imp = sub.add_parser("import", help="Importa productos (upsert por sku)")
+    imp.add_argument("path", help="Archivo CSV o JSON Lines ('-' para stdin)")
+    imp.add_argument("--format", choices=["csv", "jsonl"])
+    imp.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+
+    exp = sub.add_parser("export", help="Exporta productos a stdout")
+    exp.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+
+    args = parser.parse_args()
+    db = get_database(check=True)
+    if db is None:
+        sys.exit(1)
+
+    if args.command == "import":
+        fmt = args.format or ("jsonl" if args.path.endswith((".jsonl", ".ndjson")) else "csv")
+        if args.path == "-":
+            stats = import_products(db, sys.stdin, fmt, args.batch_size)
+        else:
+            with open(args.path, newline="", encoding="utf-8-sig") as f:
+                stats = import_products(db, f, fmt, args.batch_size)
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+    else:
+        for chunk in export_products(db, args.format):
+            sys.stdout.write(chunk)
+
+if __name__ == "__main__":
+    main()
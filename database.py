@@ -1,26 +1,160 @@
 import os
+import threading
+import time
 from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+from pymongo.errors import ConnectionFailure, PyMongoError
+from instrumentation import command_listener
 
 # Default to local MongoDB instance
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-DB_NAME = "tienda_virtual"
+DB_NAME = os.getenv("MONGO_DB_NAME", "tienda_virtual")
 
-def get_database():
+# Connection pool settings (overridable per deployment)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+
+# Seconds a successful health check is trusted before pinging again
+HEALTH_CHECK_INTERVAL = float(os.getenv("MONGO_HEALTH_CHECK_INTERVAL", "30"))
+
+# Process-wide registry: uri -> MongoClient. Keyed by pid so a forked worker
+# never reuses the sockets it inherited from its parent.
+_clients = {}
+_clients_pid = os.getpid()
+_clients_lock = threading.Lock()
+_last_healthy = {}
+_transaction_support = {}
+
+
+def _reset_after_fork():
+    """
+    Drops inherited clients in a freshly forked child (e.g. gunicorn workers).
+    The parent's clients are not closed here: their sockets belong to the parent.
+    """
+    global _clients, _clients_pid, _clients_lock
+    _clients = {}
+    _last_healthy.clear()
+    _transaction_support.clear()
+    _clients_pid = os.getpid()
+    _clients_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_client(uri=None):
     """
-    Establishes a connection to the MongoDB database and returns the database object.
+    Returns the shared MongoClient for `uri`, creating it on first use.
+    Creation is lazy: no network round-trip happens until the first command.
     """
+    uri = uri or MONGO_URI
+    if os.getpid() != _clients_pid:
+        # Fork happened without register_at_fork support
+        _reset_after_fork()
+
+    client = _clients.get(uri)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(uri)
+        if client is None:
+            client = MongoClient(
+                uri,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                connect=False,
+                event_listeners=[command_listener],
+            )
+            _clients[uri] = client
+    return client
+
+
+def check_connection(uri=None, force=False):
+    """
+    Pings the server at most once every HEALTH_CHECK_INTERVAL seconds.
+    Returns True if MongoDB answered, False otherwise.
+    """
+    uri = uri or MONGO_URI
+    now = time.monotonic()
+    last = _last_healthy.get(uri)
+    if not force and last is not None and now - last < HEALTH_CHECK_INTERVAL:
+        return True
+
     try:
-        client = MongoClient(MONGO_URI)
-        # The ismaster command is cheap and does not require auth.
-        client.admin.command('ismaster')
+        # The ping command is cheap and does not require auth.
+        get_client(uri).admin.command('ping')
+    except (ConnectionFailure, PyMongoError):
+        _last_healthy.pop(uri, None)
+        return False
+    _last_healthy[uri] = now
+    return True
+
+
+def supports_transactions(client):
+    """
+    Multi-document transactions need a replica set or a sharded cluster.
+    The answer is probed once per client with the `hello` command and cached.
+    """
+    key = id(client)
+    if key not in _transaction_support:
+        try:
+            hello = client.admin.command('hello')
+        except PyMongoError:
+            return False
+        _transaction_support[key] = bool(hello.get('setName')) or hello.get('msg') == 'isdbgrid'
+    return _transaction_support[key]
+
+
+def close_clients():
+    """
+    Closes every client owned by this process (used on shutdown and in scripts).
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _last_healthy.clear()
+        _transaction_support.clear()
+
+
+class _LazyDatabase:
+    """
+    Stand-in for a pymongo Database that resolves the current process's client
+    on every access, so module-level `db` globals stay valid after a fork.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def _resolve(self):
+        return get_client()[self._name]
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __getitem__(self, key):
+        return self._resolve()[key]
+
+
+def get_database(check=False):
+    """
+    Returns the database object backed by the shared, pooled client.
+    With check=True the server is pinged first and None is returned if it is
+    unreachable; otherwise connection errors surface on the first query.
+    """
+    if check:
+        if not check_connection(force=True):
+            print("Server not available. Please ensure MongoDB is running.")
+            return None
         print("Connected to MongoDB successfully!")
-        return client[DB_NAME]
-    except ConnectionFailure:
-        print("Server not available. Please ensure MongoDB is running.")
-        return None
+    return _LazyDatabase(DB_NAME)
 
 if __name__ == "__main__":
-    db = get_database()
+    db = get_database(check=True)
     if db is not None:
         print(f"Using database: {db.name}")
@@ -0,0 +1,116 @@
+"""
+Conditional GET for catalog pages.
+
+Views decorated with @conditional(validator) compute their ETag and
+Last-Modified from cheap in-process state first; a matching If-None-Match
+(or If-Modified-Since) is answered with 304 before the view runs, so neither
+the catalog queries nor the template rendering happen.
+"""
+import hashlib
+import os
+from functools import wraps
+from flask import make_response, request, session
+
+# Compressed HTML gets its encoding appended to the ETag (assets.py), so
+# validators coming back from the client may carry one of these suffixes
+ETAG_ENCODING_SUFFIXES = ("", "-gzip", "-br")
+
+# Seconds a shared proxy may serve an anonymous catalog page without revalidating
+PUBLIC_MAX_AGE = int(os.getenv("CATALOG_PUBLIC_MAX_AGE", "30"))
+
+_TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+
+def _templates_digest():
+    """
+    Hash of the template sources: a deploy that changes the markup changes
+    every ETag, while all workers of one deploy agree on them.
+    """
+    digest = hashlib.sha1()
+    for root, _, files in sorted(os.walk(_TEMPLATES_DIR)):
+        for name in sorted(files):
+            with open(os.path.join(root, name), "rb") as f:
+                digest.update(name.encode())
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+TEMPLATES_DIGEST = _templates_digest()
+
+
+def viewer_variant():
+    """
+    Part of the ETag that depends on who is looking: the navbar differs for
+    anonymous visitors, customers and admins.
+    """
+    user = session.get('user')
+    if not user:
+        return "anon"
+    return f"u:{user['id']}:{user.get('role')}"
+
+
+def make_etag(*parts):
+    raw = "|".join(str(p) for p in (TEMPLATES_DIGEST, viewer_variant()) + parts)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _cache_headers(response, etag, last_modified):
+    if etag:
+        response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    if session.get('user'):
+        response.headers['Cache-Control'] = 'private, no-cache'
+    else:
+        # Browsers revalidate every time; a local reverse proxy may reuse the page briefly
+        response.headers['Cache-Control'] = f'public, max-age=0, s-maxage={PUBLIC_MAX_AGE}'
+    response.vary.add('Cookie')
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _not_modified(etag, last_modified):
+    """
+    None when the page must be sent again; otherwise the ETag the 304 should
+    carry: the representation's validator the client sent back, suffix
+    included, so caches keep matching it. Empty when the client validated by
+    date only and the encoding of its copy is unknown (its stored ETag stays).
+    """
+    if request.if_none_match:
+        for suffix in ETAG_ENCODING_SUFFIXES:
+            if request.if_none_match.contains(etag + suffix):
+                return etag + suffix
+        return None
+    if last_modified and request.if_modified_since:
+        if last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None):
+            return ""
+    return None
+
+
+def conditional(validator):
+    """
+    `validator(*view_args)` returns (etag, last_modified) or None when the
+    page cannot be validated cheaply (the view then runs as usual).
+    Pages with pending flash messages are never validated or cached.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if session.get('_flashes'):
+                response = make_response(view(*args, **kwargs))
+                response.headers['Cache-Control'] = 'private, no-store'
+                return response
+
+            validators = validator(*args, **kwargs)
+            etag, last_modified = validators if validators else (None, None)
+            matched = _not_modified(etag, last_modified) if etag else None
+            if matched is not None:
+                return _cache_headers(make_response('', 304), matched, last_modified)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            return _cache_headers(response, etag, last_modified)
+        return wrapper
+    return decorator
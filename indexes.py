@@ -0,0 +1,261 @@
+"""
+Declarative index registry and query-plan audit.
+
+    python indexes.py apply    # create every index in INDEXES (idempotent)
+    python indexes.py audit    # explain() every query shape the app issues
+
+The audit exits with status 1 when a query shape falls back to a collection
+scan or examines far more documents than it returns, so it can gate CI.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING, IndexModel, TEXT
+from catalog import TEXT_INDEX_NAME, TEXT_INDEX_LANGUAGE, PRODUCT_CARD_PROJECTION
+from database import get_database
+import carts
+import recommendations
+import reviews
+import rollups
+from sessions import SESSION_COLLECTION
+
+# collection -> indexes. Names are left to MongoDB's defaults (except the text
+# index) so re-applying matches indexes created by earlier versions.
+INDEXES = {
+    "usuarios": [
+        IndexModel([("email", ASCENDING)], unique=True),
+        # count_documents({"role": "customer"}) on the analytics page
+        IndexModel([("role", ASCENDING)]),
+    ],
+    "categorias": [
+        IndexModel([("slug", ASCENDING)], unique=True),
+        IndexModel([("parent_id", ASCENDING)]),
+        # Cache invalidation poller on standalone servers (see invalidation.py)
+        IndexModel([("fecha_actualizacion", ASCENDING)]),
+    ],
+    "productos": [
+        IndexModel([("sku", ASCENDING)], unique=True),
+        IndexModel([("nombre", ASCENDING)]),
+        # Full-text search (ranked, Spanish stemming, accent-insensitive)
+        IndexModel([("nombre", TEXT), ("descripcion", TEXT)], name=TEXT_INDEX_NAME,
+                   default_language=TEXT_INDEX_LANGUAGE, weights={"nombre": 10, "descripcion": 2}),
+        # Prefix / autocomplete search over the normalized name
+        IndexModel([("nombre_normalizado", ASCENDING)]),
+        # Storefront listing: visible + category filter, keyset-paginated by sort key
+        IndexModel([("visible", ASCENDING), ("categoria.id", ASCENDING), ("precio", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("visible", ASCENDING), ("precio", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("visible", ASCENDING), ("categoria.id", ASCENDING), ("fecha_creacion", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("visible", ASCENDING), ("fecha_creacion", DESCENDING), ("_id", DESCENDING)]),
+        # Sort / filter by rating summary (see reviews.py)
+        IndexModel([("visible", ASCENDING), ("categoria.id", ASCENDING), ("rating_avg", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("visible", ASCENDING), ("rating_avg", DESCENDING), ("_id", DESCENDING)]),
+        # Low-stock products only (see inventory.py); tiny, whatever the catalog size
+        IndexModel([("bajo_stock", ASCENDING)], partialFilterExpression={"bajo_stock": True}),
+        IndexModel([("fecha_actualizacion", ASCENDING)]),
+    ],
+    reviews.REVIEWS_COLLECTION: [
+        # Paginated reviews per product, newest first
+        IndexModel([("producto_id", ASCENDING), ("fecha", DESCENDING), ("_id", DESCENDING)]),
+        # One review per user and product (migrated reviews may have no user)
+        IndexModel([("producto_id", ASCENDING), ("usuario_id", ASCENDING)], unique=True,
+                   partialFilterExpression={"usuario_id": {"$type": "objectId"}}),
+    ],
+    "carritos": [
+        # One cart per customer: lets add-to-cart upsert safely under concurrency
+        IndexModel([("cliente_id", ASCENDING)], unique=True),
+        IndexModel([("fecha_actualizacion", ASCENDING)]),
+    ],
+    "pedidos": [
+        # Order history per user, newest first, keyset-paginated on (fecha_pedido, _id)
+        IndexModel([("usuario_id", ASCENDING), ("fecha_pedido", DESCENDING), ("_id", DESCENDING)]),
+        # Recent orders on /admin
+        IndexModel([("fecha_pedido", DESCENDING)]),
+        # Order numbers come from order_numbers.py; the index guarantees uniqueness
+        IndexModel([("numero_pedido", ASCENDING)], unique=True),
+    ],
+    SESSION_COLLECTION: [
+        # Server-side sessions expire through a TTL index on 'expira'
+        IndexModel([("expira", ASCENDING)], expireAfterSeconds=0),
+        # Every session of one user (sessions.refresh_user_sessions)
+        IndexModel([("user_id", ASCENDING)]),
+    ],
+    rollups.PERIODOS: [IndexModel([("periodo", ASCENDING), ("_id", ASCENDING)])],
+    rollups.PRODUCTOS: [IndexModel([("quantity", DESCENDING)])],
+    rollups.CATEGORIAS: [IndexModel([("revenue", DESCENDING)])],
+}
+
+
+def apply_indexes(db, registry=INDEXES):
+    """
+    Creates every registered index. createIndexes is a no-op for indexes
+    that already exist with the same keys and options.
+    """
+    for collection, models in registry.items():
+        created = db[collection].create_indexes(models)
+        print(f"  {collection}: {', '.join(created)}")
+
+
+def apply_on_startup(db):
+    """
+    Applies the registry when MONGO_AUTO_INDEXES=1. Off by default so web
+    workers boot without a round-trip; deployments run `python indexes.py apply`.
+    """
+    if os.getenv("MONGO_AUTO_INDEXES", "0") == "1":
+        apply_indexes(db)
+
+
+# --- Audit ---
+
+# Examined-documents-per-result ratio above which a plan is flagged
+SELECTIVITY_THRESHOLD = float(os.getenv("INDEX_AUDIT_SELECTIVITY", "10"))
+
+
+def query_shapes(db):
+    """
+    Representative instance of every query main.py issues, with sample
+    values taken from the data. Each entry: (name, collection, command, allow_collscan).
+    Writes (checkout, carts) are audited through a find with the same filter.
+    """
+    product = db.productos.find_one({"visible": True}, {"categoria.id": 1}) or {}
+    user = db.usuarios.find_one({}, {"email": 1}) or {}
+    category = db.categorias.find_one({}, {"slug": 1}) or {}
+    order = db.pedidos.find_one({}, {"numero_pedido": 1}) or {}
+    pid, uid = product.get("_id"), user.get("_id")
+    cat_id = (product.get("categoria") or {}).get("id")
+    page = 25
+
+    def find(coll, filter, sort=None, limit=None, projection=None):
+        cmd = {"find": coll, "filter": filter}
+        if sort:
+            cmd["sort"] = sort
+        if limit:
+            cmd["limit"] = limit
+        if projection:
+            cmd["projection"] = projection
+        return cmd
+
+    return [
+        ("index: newest", "productos",
+         find("productos", {"visible": True}, {"fecha_creacion": -1, "_id": -1}, page, PRODUCT_CARD_PROJECTION), False),
+        ("index: category by price", "productos",
+         find("productos", {"visible": True, "categoria.id": {"$in": [cat_id]}}, {"precio": 1, "_id": 1}, page), False),
+        ("index: text search", "productos",
+         find("productos", {"visible": True, "$text": {"$search": "laptop"}}, None, page), False),
+        ("index: prefix search", "productos",
+         find("productos", {"visible": True, "nombre_normalizado": {"$regex": "^lap"}}, {"nombre_normalizado": 1, "_id": 1}, page), False),
+        ("index: best rated", "productos",
+         find("productos", {"visible": True, "rating_avg": {"$gte": 4}}, {"rating_avg": -1, "_id": -1}, page), False),
+        ("product_details", "productos", find("productos", {"_id": pid}), False),
+        ("product reviews", reviews.REVIEWS_COLLECTION,
+         find(reviews.REVIEWS_COLLECTION, {"producto_id": pid}, {"fecha": -1, "_id": -1}, reviews.REVIEW_PAGE_SIZE + 1), False),
+        ("recommendations", recommendations.RECOMMENDATIONS_COLLECTION,
+         find(recommendations.RECOMMENDATIONS_COLLECTION, {"_id": pid}), False),
+        ("recommendation cards", "productos",
+         find("productos", recommendations.current_filter([pid]), projection=recommendations.RECOMMENDATION_PROJECTION), False),
+        ("recommendations fallback", "productos",
+         find("productos", {"visible": True, "categoria.id": cat_id, "_id": {"$ne": pid}}, None, 4), False),
+        ("cart", "carritos", find("carritos", {"cliente_id": uid}), False),
+        # carts.py: every add/remove/totals update targets the user's cart
+        ("cart update", "carritos", find("carritos", {"cliente_id": uid}, projection=carts.CART_SUMMARY_PROJECTION), False),
+        # orders.py: conditional stock decrement, then release or confirm of the reservation
+        ("checkout reserve", "productos", find("productos", {"_id": pid, "stock": {"$gte": 1}}), False),
+        ("checkout release", "productos", find("productos", {"_id": pid, "reservas": "x"}), False),
+        ("checkout confirm", "productos", find("productos", {"_id": {"$in": [pid]}}), False),
+        ("order_details", "pedidos", find("pedidos", {"_id": order.get("_id")}), False),
+        # Unique index checked on every order insert
+        ("order number", "pedidos", find("pedidos", {"numero_pedido": order.get("numero_pedido")}), False),
+        ("dashboard orders", "pedidos",
+         find("pedidos", {"usuario_id": uid}, {"fecha_pedido": -1, "_id": -1}, page), False),
+        ("dashboard totals", rollups.CLIENTES, find(rollups.CLIENTES, {"_id": uid}), False),
+        ("admin recent orders", "pedidos", find("pedidos", {}, {"fecha_pedido": -1}, 10), False),
+        ("low stock set", "productos", find("productos", {"bajo_stock": True}), False),
+        ("invalidation poll", "productos",
+         find("productos", {"fecha_actualizacion": {"$gte": datetime.utcnow()}}, {"fecha_actualizacion": 1}), False),
+        ("login", "usuarios", find("usuarios", {"email": user.get("email")}), False),
+        ("analytics customers", "usuarios", {"count": "usuarios", "query": {"role": "customer"}}, False),
+        ("category by slug", "categorias", find("categorias", {"slug": category.get("slug")}), False),
+        # Loaded whole, once per CategoryTree TTL
+        ("category tree", "categorias", find("categorias", {}), True),
+        ("session", SESSION_COLLECTION, find(SESSION_COLLECTION, {"_id": "x", "expira": {"$gt": 0}}), False),
+        ("user sessions", SESSION_COLLECTION, find(SESSION_COLLECTION, {"user_id": str(uid)}), False),
+        ("rollup months", rollups.PERIODOS, find(rollups.PERIODOS, {"periodo": "mes"}, {"_id": 1}), False),
+        ("rollup top products", rollups.PRODUCTOS, find(rollups.PRODUCTOS, {}, {"quantity": -1}, 5), False),
+        ("rollup top category", rollups.CATEGORIAS, find(rollups.CATEGORIAS, {}, {"revenue": -1}, 1), False),
+    ]
+
+
+def _stages(plan):
+    """
+    Every stage name in a (possibly nested) winning plan.
+    """
+    if not isinstance(plan, dict):
+        return []
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key in ("inputStage", "queryPlan"):
+        stages += _stages(plan.get(key))
+    for child in plan.get("inputStages", []):
+        stages += _stages(child)
+    return stages
+
+
+def explain_shape(db, command):
+    result = db.command("explain", command, verbosity="executionStats")
+    planner = result.get("queryPlanner", {})
+    stats = result.get("executionStats", {})
+    stages = _stages(planner.get("winningPlan", {}))
+    returned = stats.get("nReturned", 0)
+    return {
+        "stages": stages,
+        "collscan": "COLLSCAN" in stages,
+        "returned": returned,
+        "docs_examined": stats.get("totalDocsExamined", 0),
+        "keys_examined": stats.get("totalKeysExamined", 0),
+        "millis": stats.get("executionTimeMillis", 0),
+        "ratio": stats.get("totalDocsExamined", 0) / max(returned, 1),
+    }
+
+
+def audit(db, threshold=SELECTIVITY_THRESHOLD):
+    """
+    Explains every query shape and prints a report. Returns the list of problems.
+    """
+    problems = []
+    print(f"{'query':<28}{'plan':<36}{'ret':>7}{'docs':>9}{'keys':>9}{'ms':>6}")
+    for name, collection, command, allow_collscan in query_shapes(db):
+        info = explain_shape(db, command)
+        flags = []
+        if info["collscan"] and not allow_collscan and db[collection].estimated_document_count() > 0:
+            flags.append("COLLSCAN")
+        if info["ratio"] > threshold and info["docs_examined"] > threshold:
+            flags.append(f"poor selectivity ({info['ratio']:.0f} docs/result)")
+        plan = ">".join(reversed(info["stages"]))[:34]
+        print(f"{name:<28}{plan:<36}{info['returned']:>7}{info['docs_examined']:>9}"
+              f"{info['keys_examined']:>9}{info['millis']:>6}  {' '.join(flags)}")
+        problems += [f"{name}: {flag}" for flag in flags]
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index registry and query-plan audit.")
+    parser.add_argument("command", choices=["apply", "audit"])
+    args = parser.parse_args()
+
+    db = get_database(check=True)
+    if db is None:
+        sys.exit(1)
+
+    if args.command == "apply":
+        apply_indexes(db)
+        return
+
+    problems = audit(db)
+    if problems:
+        print("\nProblems:")
+        for problem in problems:
+            print("  " + problem)
+        sys.exit(1)
+    print("\nAll query shapes use an index.")
+
+if __name__ == "__main__":
+    main()
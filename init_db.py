@@ -1,9 +1,22 @@
+import argparse
+from bson.objectid import ObjectId
 from database import get_database
+import synthetic_data
+import rollups
+import recommendations
+import inventory
+from indexes import apply_indexes
+from catalog import normalize_text
+from reviews import EMPTY_RATING
 from datetime import datetime
 import hashlib
 
-def init_db():
-    db = get_database()
+def init_db(synthetic=None):
+    """
+    Rebuilds the database with the base catalog. `synthetic` is an optional
+    dict of synthetic_data.load() options for production-scale seeding.
+    """
+    db = get_database(check=True)
     if db is None:
         return
 
@@ -20,7 +33,6 @@ def init_db():
     
     # Usuarios (Users)
     print("Initializing 'usuarios'...")
-    db.usuarios.create_index("email", unique=True)
     
     # Create an admin user and a regular customer
     users_data = [
@@ -62,6 +74,13 @@ def init_db():
     #       CATEGORÍAS BASE
     # ============================
 
+    categories_data = []
+    # Synthetic runs derive category ids from the seed: products and orders are
+    # spread over the categories in _id order, which must not change between runs
+    new_category_id = ObjectId
+    if synthetic:
+        new_category_id = synthetic_data.category_ids(synthetic.get("seed", synthetic_data.DEFAULT_SEED))
+
     # Tecnología
     tech_category = {
         "nombre": "Tecnología",
@@ -70,7 +89,8 @@ def init_db():
         "parent_id": None,
         "fecha_creacion": datetime.utcnow()
     }
-    tech_id = db.categorias.insert_one(tech_category).inserted_id
+    tech_id = tech_category["_id"] = new_category_id()
+    categories_data.append(tech_category)
 
     # Ropa
     clothing_category = {
@@ -80,7 +100,8 @@ def init_db():
         "parent_id": None,
         "fecha_creacion": datetime.utcnow()
     }
-    clothing_id = db.categorias.insert_one(clothing_category).inserted_id
+    clothing_id = clothing_category["_id"] = new_category_id()
+    categories_data.append(clothing_category)
 
     # Coleccionables (antes Juguetes)
     collectibles_category = {
@@ -90,7 +111,8 @@ def init_db():
         "parent_id": None,
         "fecha_creacion": datetime.utcnow()
     }
-    collectibles_id = db.categorias.insert_one(collectibles_category).inserted_id
+    collectibles_id = collectibles_category["_id"] = new_category_id()
+    categories_data.append(collectibles_category)
 
 
     # ============================
@@ -105,7 +127,8 @@ def init_db():
         "parent_id": tech_id,
         "fecha_creacion": datetime.utcnow()
     }
-    laptops_id = db.categorias.insert_one(laptops_category).inserted_id
+    laptops_id = laptops_category["_id"] = new_category_id()
+    categories_data.append(laptops_category)
 
     # Smartphones
     smartphones_category = {
@@ -115,7 +138,8 @@ def init_db():
         "parent_id": tech_id,
         "fecha_creacion": datetime.utcnow()
     }
-    smartphones_id = db.categorias.insert_one(smartphones_category).inserted_id
+    smartphones_id = smartphones_category["_id"] = new_category_id()
+    categories_data.append(smartphones_category)
 
     # Auriculares
     headphones_category = {
@@ -125,7 +149,8 @@ def init_db():
         "parent_id": tech_id,
         "fecha_creacion": datetime.utcnow()
     }
-    headphones_id = db.categorias.insert_one(headphones_category).inserted_id
+    headphones_id = headphones_category["_id"] = new_category_id()
+    categories_data.append(headphones_category)
 
     # Monitores
     monitors_category = {
@@ -135,7 +160,8 @@ def init_db():
         "parent_id": tech_id,
         "fecha_creacion": datetime.utcnow()
     }
-    monitors_id = db.categorias.insert_one(monitors_category).inserted_id
+    monitors_id = monitors_category["_id"] = new_category_id()
+    categories_data.append(monitors_category)
 
 
     # ============================
@@ -150,7 +176,8 @@ def init_db():
         "parent_id": collectibles_id,
         "fecha_creacion": datetime.utcnow()
     }
-    action_figures_id = db.categorias.insert_one(action_figures_category).inserted_id
+    action_figures_id = action_figures_category["_id"] = new_category_id()
+    categories_data.append(action_figures_category)
 
     # Cartas Coleccionables
     cards_category = {
@@ -160,7 +187,8 @@ def init_db():
         "parent_id": collectibles_id,
         "fecha_creacion": datetime.utcnow()
     }
-    cards_id = db.categorias.insert_one(cards_category).inserted_id
+    cards_id = cards_category["_id"] = new_category_id()
+    categories_data.append(cards_category)
 
 
     # ============================
@@ -174,7 +202,8 @@ def init_db():
         "parent_id": clothing_id,
         "fecha_creacion": datetime.utcnow()
     }
-    hoodies_id = db.categorias.insert_one(hoodies_category).inserted_id
+    hoodies_id = hoodies_category["_id"] = new_category_id()
+    categories_data.append(hoodies_category)
 
     tshirts_category = {
         "nombre": "Camisetas",
@@ -183,7 +212,8 @@ def init_db():
         "parent_id": clothing_id,
         "fecha_creacion": datetime.utcnow()
     }
-    tshirts_id = db.categorias.insert_one(tshirts_category).inserted_id
+    tshirts_id = tshirts_category["_id"] = new_category_id()
+    categories_data.append(tshirts_category)
 
     skirts_category = {
         "nombre": "Faldas",
@@ -192,7 +222,8 @@ def init_db():
         "parent_id": clothing_id,
         "fecha_creacion": datetime.utcnow()
     }
-    skirts_id = db.categorias.insert_one(skirts_category).inserted_id
+    skirts_id = skirts_category["_id"] = new_category_id()
+    categories_data.append(skirts_category)
 
     soccer_category = {
         "nombre": "Camisetas Deportivas",
@@ -201,7 +232,8 @@ def init_db():
         "parent_id": clothing_id,
         "fecha_creacion": datetime.utcnow()
     }
-    soccer_id = db.categorias.insert_one(soccer_category).inserted_id
+    soccer_id = soccer_category["_id"] = new_category_id()
+    categories_data.append(soccer_category)
 
     # ============================
     #   SUBCATEGORÍAS GAFAS / JOYERÍA
@@ -214,7 +246,8 @@ def init_db():
         "parent_id": tech_id,
         "fecha_creacion": datetime.utcnow()
     }
-    smart_glasses_id = db.categorias.insert_one(smart_glasses_category).inserted_id
+    smart_glasses_id = smart_glasses_category["_id"] = new_category_id()
+    categories_data.append(smart_glasses_category)
 
     jewelry_category = {
         "nombre": "Joyería",
@@ -223,7 +256,8 @@ def init_db():
         "parent_id": None,
         "fecha_creacion": datetime.utcnow()
     }
-    jewelry_id = db.categorias.insert_one(jewelry_category).inserted_id
+    jewelry_id = jewelry_category["_id"] = new_category_id()
+    categories_data.append(jewelry_category)
 
     mens_jewelry_category = {
         "nombre": "Joyería para Hombre",
@@ -232,15 +266,12 @@ def init_db():
         "parent_id": jewelry_id,
         "fecha_creacion": datetime.utcnow()
     }
-    mens_jewelry_id = db.categorias.insert_one(mens_jewelry_category).inserted_id
-
+    mens_jewelry_id = mens_jewelry_category["_id"] = new_category_id()
+    categories_data.append(mens_jewelry_category)
 
-    # ============================
-    #        ÍNDICES PRODUCTOS
-    # ============================
 
-    db.productos.create_index("sku", unique=True)
-    db.productos.create_index("nombre", unique=False)
+    # All categories in one round-trip (ids are assigned client-side above)
+    db.categorias.insert_many(categories_data)
 
 
     # ============================
@@ -266,8 +297,7 @@ def init_db():
                 "https://cdn-dynmedia-1.microsoft.com/is/image/microsoftcorp/B03-Surface-Laptop-13-inch-1Ed-Rational-Violet-Rear-Right"
             ],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "LAP-002",
@@ -282,8 +312,7 @@ def init_db():
                 "https://www.gatewayusa.com/cdn/shop/files/black16_f7c7d052-2222-427e-9dc6-174f2928718f.png?v=1721623728&width=1400"
             ],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
 
         # ============================================
@@ -303,8 +332,7 @@ def init_db():
                 "https://images.fonearena.com/blog/wp-content/uploads/2022/07/Samsung-Galaxy-S22-Bora-Purple-1024x911.jpg"
             ],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "SMA-002",
@@ -319,8 +347,7 @@ def init_db():
                 "https://http2.mlstatic.com/D_NQ_NP_772634-MCO70066305388_062023-O.webp"
             ],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
 
         # ============================================
@@ -340,8 +367,7 @@ def init_db():
                 "https://rukminim2.flixcart.com/image/480/640/xif0q/headphone/a/k/i/-original-imahyfkkhwpeb7ze.jpeg?q=90"
             ],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "AUR-002",
@@ -356,8 +382,7 @@ def init_db():
                 "https://www.sony.com.co/image/5d02da5df552836db894cead8a68f5f3?fmt=pjpeg&wid=330&bgcolor=FFFFFF&bgc=FFFFFF"
             ],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
 
         # ============================================
@@ -377,8 +402,7 @@ def init_db():
                 "https://www.lg.com/content/dam/channel/wcms/co/images/monitores/34wq500-b/gallery/ultrawide-34wq500-gallery-01-2010.jpg/_jcr_content/renditions/thum-1600x1062.jpeg"
             ],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "MON-002",
@@ -393,8 +417,7 @@ def init_db():
                 "https://es-store.msi.com/cdn/shop/files/monitor-gaming-msi-mag-27c6x.png?v=1733326643&width=640"
             ],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
 
         # ============================================
@@ -413,8 +436,7 @@ def init_db():
             "atributos": {"franquicia": "Marvel", "altura": "25 cm"},
             "imagenes": ["https://alteregocomics.com/cdn/shop/files/hot-toys-marvel-daredevil-sixth-scale-figure-gallery-67eabdb51471c.jpg?v=1743442148&width=1946"],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "FIG-002",
@@ -427,8 +449,7 @@ def init_db():
             "atributos": {"franquicia": "Marvel", "altura": "25 cm"},
             "imagenes": ["https://m.media-amazon.com/images/I/81W0CWI3DNL.jpg"],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
 
         # Cartas coleccionables
@@ -443,8 +464,7 @@ def init_db():
             "atributos": {"marca": "Pokémon", "tipo": "Expansión actual"},
             "imagenes": ["https://xtremeplay.co/wp-content/uploads/2023/03/TOYCOLPOK1312_1.jpg"],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "CAR-002",
@@ -457,12 +477,14 @@ def init_db():
             "atributos": {"marca": "Exploding Kittens", "tipo": "Party Pack"},
             "imagenes": ["https://media.falabella.com/falabellaCO/124472703_01/w=1500,h=1500,fit=pad"],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         }
         
     ]
 
+    for p in products_data:
+        p["nombre_normalizado"] = normalize_text(p["nombre"])
+        p.update(EMPTY_RATING)
     db.productos.insert_many(products_data)
 
     # ============================
@@ -482,8 +504,7 @@ def init_db():
             "atributos": {"marca": "VisionX", "color": "Negro", "conectividad": "Bluetooth"},
             "imagenes": ["https://http2.mlstatic.com/D_NQ_NP_622593-CBT78119687397_082024-O.webp"],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "CLOT-HOOD-001",
@@ -496,8 +517,7 @@ def init_db():
             "atributos": {"marca": "GalaxyWear", "talla": "M"},
             "imagenes": ["https://acdn-us.mitiendanube.com/stores/002/114/613/products/a93ce007-639a-4ac1-8f63-934274b666801-a5a526f854751ddf4b16494526294213-640-0.png"],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "CLOT-SHIRT-001",
@@ -510,8 +530,7 @@ def init_db():
             "atributos": {"marca": "BasicWear", "talla": "L"},
             "imagenes": ["https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcRdWIhVeC5aGhe4z7cRU_D4y98fVzql46mhdA&s"],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "JEW-MAN-NECK-001",
@@ -524,8 +543,7 @@ def init_db():
             "atributos": {"material": "Aleación", "acabado": "Dorado"},
             "imagenes": ["https://cdn-media.glamira.com/media/product/newgeneration/view/1/sku/14976lobris-2.50/diamond/diamond-zirconia_AAAAA/alloycolour/yellow.jpg"],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "JEW-RING-001",
@@ -538,8 +556,7 @@ def init_db():
             "atributos": {"material": "Oro", "talla": "10"},
             "imagenes": ["https://cdn-media.glamira.com/media/product/newgeneration/view/1/sku/15549gisu1/diamond/diamond-Brillant_AAA/stone2/diamond-Brillant_AAA/stone3/diamond-Brillant_AAA/alloycolour/yellow.jpg"],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "JEW-RING-002",
@@ -552,8 +569,7 @@ def init_db():
             "atributos": {"material": "Oro Blanco"},
             "imagenes": ["https://cdn-media.glamira.com/media/product/newgeneration/view/1/sku/22136bridal-rise05/diamond/lab-grown-diamond_AAA/alloycolour/white.jpg"],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "JEW-RING-003",
@@ -566,8 +582,7 @@ def init_db():
             "atributos": {"material": "Plata"},
             "imagenes": ["https://cdn-media.glamira.com/media/product/newgeneration/view/1/sku/GWD210000/alloycolour/white/width/w4/profile/prA/surface/polished.jpg"],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "CLOT-SKIRT-001",
@@ -580,8 +595,7 @@ def init_db():
             "atributos": {"material": "Tela", "talla": "M"},
             "imagenes": ["https://aguamarinaoficial.com/cdn/shop/files/2_ce0477c4-cec0-4d51-be6e-0e6afd71e3d8.jpg?v=1750965921"],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "CLOT-SKIRT-002",
@@ -594,8 +608,7 @@ def init_db():
             "atributos": {"material": "Cuero sintético"},
             "imagenes": ["https://m.media-amazon.com/images/I/41TsOKYhUlL._AC_UY1000_.jpg"],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         },
         {
             "sku": "CLOT-SOCC-001",
@@ -608,11 +621,13 @@ def init_db():
             "atributos": {"equipo": "Inter de Milán", "talla": "L"},
             "imagenes": ["https://nikeco.vtexassets.com/arquivos/ids/873730/HJ4591_439_A_PREM.jpg?v=638839496465270000"],
             "fecha_creacion": datetime.utcnow(),
-            "visible": True,
-            "reseñas": []
+            "visible": True
         }
     ]
 
+    for p in additional_products:
+        p["nombre_normalizado"] = normalize_text(p["nombre"])
+        p.update(EMPTY_RATING)
     db.productos.insert_many(additional_products)
 
 
@@ -623,7 +638,57 @@ def init_db():
     # NOTE: Per configuration, do not insert default/example orders.
     # The 'pedidos' collection will be created empty.
 
+    if synthetic:
+        # Production-scale data; indexes are built once, after the bulk load
+        synthetic_data.load(db, **synthetic)
+
+    # Low-stock flags (one server-side pipeline update over the catalog)
+    inventory.refresh_flags(db.productos)
+
+    print("Creating indexes...")
+    create_indexes(db)
+
+    if synthetic:
+        print("Rebuilding sales rollups...")
+        rollups.rebuild(db)
+
+    # Co-purchase recommendations for product pages (empty until there are orders)
+    recommendations.refresh(db)
+
     print("Database initialization complete!")
 
+
+def create_indexes(db):
+    """
+    Creates every index the application relies on (see indexes.INDEXES).
+    Kept separate from the data load so bulk seeding can build indexes once,
+    after inserting.
+    """
+    apply_indexes(db)
+
 if __name__ == "__main__":
-    init_db()
+    parser = argparse.ArgumentParser(description="Inicializa la base de datos de la tienda.")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="Además de los datos base, genera datos sintéticos a escala")
+    parser.add_argument("--products", type=int, default=synthetic_data.DEFAULT_PRODUCTS)
+    parser.add_argument("--users", type=int, default=synthetic_data.DEFAULT_USERS)
+    parser.add_argument("--orders", type=int, default=synthetic_data.DEFAULT_ORDERS)
+    parser.add_argument("--days", type=int, default=synthetic_data.DEFAULT_DAYS,
+                        help="Días de historial de pedidos")
+    parser.add_argument("--workers", type=int, default=synthetic_data.DEFAULT_WORKERS)
+    parser.add_argument("--batch-size", type=int, default=synthetic_data.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--seed", type=int, default=synthetic_data.DEFAULT_SEED)
+    args = parser.parse_args()
+
+    synthetic = None
+    if args.synthetic:
+        synthetic = {
+            "products": args.products,
+            "users": args.users,
+            "orders": args.orders,
+            "days": args.days,
+            "workers": args.workers,
+            "batch_size": args.batch_size,
+            "seed": args.seed,
+        }
+    init_db(synthetic=synthetic)
@@ -0,0 +1,191 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from flask import g, request
+from pymongo import monitoring
+
+logger = logging.getLogger("tienda.mongo")
+
+# Commands slower than this (milliseconds) are logged with their filter shape
+SLOW_QUERY_MS = float(os.getenv("MONGO_SLOW_QUERY_MS", "100"))
+# Latency samples kept per route for the percentile report
+ROUTE_SAMPLE_SIZE = int(os.getenv("METRICS_SAMPLE_SIZE", "1000"))
+
+# Per-request Mongo statistics. pymongo publishes command events on the thread
+# that issued the command, so a context variable scopes them to the request.
+_current = contextvars.ContextVar("mongo_request_stats", default=None)
+
+# Commands in flight: request_id -> (command name, command document)
+_pending = {}
+
+
+class RequestStats:
+    def __init__(self):
+        self.commands = 0
+        self.duration_ms = 0.0
+        self.collections = set()
+        self.started_at = time.perf_counter()
+
+
+def _collection_of(event):
+    value = event.command.get(event.command_name)
+    return value if isinstance(value, str) else None
+
+
+def _shape(value):
+    """
+    Replaces literal values with "?" while keeping field names and operators,
+    so slow queries can be grouped by pattern without logging user data.
+    """
+    if isinstance(value, dict):
+        return {k: _shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_shape(v) for v in value[:3]]
+    return "?"
+
+
+def filter_shape(command_name, command):
+    if command_name == "find":
+        return _shape(command.get("filter", {}))
+    if command_name == "aggregate":
+        return _shape(command.get("pipeline", []))
+    if command_name in ("update", "delete"):
+        key = "updates" if command_name == "update" else "deletes"
+        return [_shape(op.get("q", {})) for op in command.get(key, [])[:3]]
+    if command_name in ("count", "findAndModify"):
+        return _shape(command.get("query", {}))
+    return None
+
+
+class CommandListener(monitoring.CommandListener):
+    """
+    Records count, duration and collections of the commands each request sends
+    to MongoDB, and logs any command slower than SLOW_QUERY_MS.
+    """
+
+    def started(self, event):
+        stats = _current.get()
+        if stats is not None:
+            stats.commands += 1
+            collection = _collection_of(event)
+            if collection:
+                stats.collections.add(collection)
+        _pending[event.request_id] = (event.command_name, event.command)
+
+    def _finished(self, event):
+        name, command = _pending.pop(event.request_id, (event.command_name, None))
+        duration_ms = event.duration_micros / 1000.0
+        stats = _current.get()
+        if stats is not None:
+            stats.duration_ms += duration_ms
+        if duration_ms >= SLOW_QUERY_MS and command is not None:
+            logger.warning("Slow Mongo command %s on %s took %.1f ms; shape=%s",
+                           name, command.get(name), duration_ms, filter_shape(name, command))
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+
+command_listener = CommandListener()
+
+
+def current_stats():
+    return _current.get()
+
+
+class RouteMetrics:
+    """
+    Rolling latency samples per route: total time, Mongo time and command count.
+    """
+
+    def __init__(self, sample_size=ROUTE_SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, total_ms, stats):
+        with self._lock:
+            samples = self._routes.get(route)
+            if samples is None:
+                samples = self._routes[route] = {
+                    "count": 0,
+                    "total_ms": deque(maxlen=self.sample_size),
+                    "db_ms": deque(maxlen=self.sample_size),
+                    "commands": deque(maxlen=self.sample_size),
+                    "collections": set(),
+                }
+            samples["count"] += 1
+            samples["total_ms"].append(total_ms)
+            samples["db_ms"].append(stats.duration_ms)
+            samples["commands"].append(stats.commands)
+            samples["collections"].update(stats.collections)
+
+    @staticmethod
+    def _percentiles(values):
+        ordered = sorted(values)
+        if not ordered:
+            return {"p50": 0, "p95": 0, "p99": 0}
+
+        def pick(q):
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+        return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+    def snapshot(self):
+        with self._lock:
+            routes = {route: {k: (list(v) if isinstance(v, (deque, set)) else v) for k, v in s.items()}
+                      for route, s in self._routes.items()}
+        return {
+            route: {
+                "count": s["count"],
+                "latency_ms": self._percentiles(s["total_ms"]),
+                "db_ms": self._percentiles(s["db_ms"]),
+                "commands": self._percentiles(s["commands"]),
+                "collections": sorted(s["collections"]),
+            }
+            for route, s in routes.items()
+        }
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+route_metrics = RouteMetrics()
+
+
+def init_app(app):
+    """
+    Starts a RequestStats for every request, reports it in the Server-Timing
+    and X-DB-Roundtrips response headers and feeds the per-route metrics.
+    """
+
+    @app.before_request
+    def _begin_db_stats():
+        stats = RequestStats()
+        g.db_stats_token = _current.set(stats)
+
+    @app.after_request
+    def _report_db_stats(response):
+        stats = _current.get()
+        if stats is not None:
+            total_ms = (time.perf_counter() - stats.started_at) * 1000.0
+            response.headers['X-DB-Roundtrips'] = str(stats.commands)
+            response.headers['Server-Timing'] = (
+                f'db;dur={stats.duration_ms:.1f};desc="{stats.commands} mongo commands", '
+                f'app;dur={total_ms:.1f}'
+            )
+            route = request.url_rule.rule if request.url_rule else "<unmatched>"
+            route_metrics.record(f"{request.method} {route}", total_ms, stats)
+        return response
+
+    @app.teardown_request
+    def _end_db_stats(exc=None):
+        token = g.pop('db_stats_token', None)
+        if token is not None:
+            _current.reset(token)
@@ -0,0 +1,294 @@
+"""
+Cross-worker cache invalidation.
+
+    python invalidation.py watch    # print every invalidation event as it arrives
+
+Each process runs one InvalidationBus: a daemon thread that tails a single
+database-level change stream filtered to the watched collections (replica
+sets) or polls their `fecha_actualizacion` field (standalone servers), and
+hands every change to the cache regions registered for that collection.
+Writes made by any worker therefore reach the in-process caches of all of
+them, so those caches can keep long TTLs.
+
+Events are dicts:
+    {"coleccion": "productos", "tipo": "insert" | "update" | "replace" | "delete" | "reload",
+     "id": document _id (None for "reload"), "campos": changed top-level fields or None,
+     "fecha": datetime}
+"reload" means individual changes were lost (stream history expired, a
+collection was dropped, a delete went unseen while polling): the region
+must drop everything it holds for that collection.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pymongo.errors import OperationFailure, PyMongoError
+from database import get_database, supports_transactions
+
+logger = logging.getLogger("tienda.invalidation")
+
+# Collections whose changes are published
+WATCHED_COLLECTIONS = ("productos", "categorias", "carritos")
+# Updates that only touch these fields are not published: they never change
+# what a cached page shows (checkout reservation tokens, the low-stock flag)
+IGNORED_FIELDS = {"productos": {"reservas", "bajo_stock"}}
+
+# Last stream position, one document per bus: {_id: name, token, fecha}
+RESUME_TOKENS_COLLECTION = "resume_tokens"
+# Seconds between saves of the resume token (every worker saves the same document)
+TOKEN_SAVE_SECONDS = float(os.getenv("INVALIDATION_TOKEN_SAVE_SECONDS", "10"))
+# Polling interval when the server has no change streams (standalone mongod)
+POLL_SECONDS = float(os.getenv("INVALIDATION_POLL_SECONDS", "5"))
+
+# Change stream operation types published as-is; anything else on a watched
+# collection ("drop", "rename", "invalidate") becomes a "reload"
+DOCUMENT_OPERATIONS = ("insert", "update", "replace", "delete")
+# Server errors meaning a stored resume token can no longer be used
+# (ChangeStreamFatalError, ChangeStreamHistoryLost, CappedPositionLost)
+RESUME_FAILURE_CODES = (280, 286, 136)
+
+
+def lru_region(cache, key=str):
+    """
+    Handler for an LRUCache keyed by `key(document _id)`.
+    """
+
+    def handler(event):
+        if event['id'] is None:
+            cache.clear()
+        else:
+            cache.invalidate(key(event['id']))
+    return handler
+
+
+class InvalidationBus:
+    """
+    Publishes changes to productos, categorias and carritos to the cache
+    regions of this process (LowStockMonitor is one of them). Started once
+    per process: after a fork the thread does not exist in the child.
+    """
+
+    def __init__(self, db, name="cache", collections=WATCHED_COLLECTIONS, poll_seconds=POLL_SECONDS):
+        self.db = db
+        self.name = name
+        self.collections = tuple(collections)
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._regions = {}
+        self._started_pid = None
+        self._resume_token = None
+        self._token_loaded = False
+        self._token_saved_at = 0
+        self._watermarks = {}
+        self._counts = {}
+
+    # --- Public API ---
+
+    def register(self, name, collections, handler):
+        """
+        Registers cache region `name`: `handler(event)` is called from the bus
+        thread for every change to one of `collections`.
+        """
+        for coleccion in collections:
+            if coleccion not in self.collections:
+                raise ValueError(f"{coleccion} is not watched by the invalidation bus")
+        with self._lock:
+            self._regions[name] = (frozenset(collections), handler)
+
+    def start(self):
+        """
+        Starts the bus thread, once per process. Cheap to call from request
+        handlers after the first time.
+        """
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._resume_token = None
+            self._token_loaded = False
+            self._watermarks = {}
+            self._counts = {}
+        threading.Thread(target=self._run, name=f"invalidation-{self.name}", daemon=True).start()
+
+    def publish(self, coleccion, tipo, doc_id=None, campos=None):
+        event = {"coleccion": coleccion, "tipo": tipo, "id": doc_id, "campos": campos,
+                 "fecha": datetime.utcnow()}
+        with self._lock:
+            regions = list(self._regions.items())
+        for name, (collections, handler) in regions:
+            if coleccion not in collections:
+                continue
+            try:
+                handler(event)
+            except Exception:
+                logger.exception("Cache region %s failed to handle %s", name, tipo)
+
+    def reload(self, collections=None):
+        for coleccion in collections or self._active_collections():
+            self.publish(coleccion, "reload")
+
+    # --- Bus thread ---
+
+    def _active_collections(self):
+        """
+        Watched collections that at least one region cares about.
+        """
+        with self._lock:
+            wanted = set().union(*(c for c, _ in self._regions.values()))
+        return [c for c in self.collections if c in wanted]
+
+    def _run(self):
+        while True:
+            try:
+                if supports_transactions(self.db.client):
+                    # Change streams need a replica set, the same requirement as transactions
+                    self._watch()
+                else:
+                    self._poll()
+                    time.sleep(self.poll_seconds)
+            except OperationFailure as e:
+                if e.code not in RESUME_FAILURE_CODES:
+                    logger.warning("Invalidation bus error, retrying: %s", e)
+                else:
+                    # The resume token is older than the oplog: changes were lost
+                    logger.warning("Invalidation stream could not resume, reloading caches: %s", e)
+                    self._resume_token = None
+                    self._save_token(force=True)
+                    self.reload()
+                time.sleep(self.poll_seconds)
+            except PyMongoError as e:
+                # Keep the token: the next stream resumes where this one stopped
+                logger.warning("Invalidation bus error, retrying: %s", e)
+                time.sleep(self.poll_seconds)
+
+    # --- Change streams ---
+
+    def _load_token(self):
+        doc = self.db[RESUME_TOKENS_COLLECTION].find_one({"_id": self.name}, {"token": 1})
+        return doc.get('token') if doc else None
+
+    def _save_token(self, force=False):
+        """
+        Stores the stream position so a restarted process resumes from it
+        instead of from "now". Throttled to one write per TOKEN_SAVE_SECONDS.
+        """
+        now = time.monotonic()
+        if not force and now - self._token_saved_at < TOKEN_SAVE_SECONDS:
+            return
+        self._token_saved_at = now
+        self.db[RESUME_TOKENS_COLLECTION].update_one(
+            {"_id": self.name},
+            {"$set": {"token": self._resume_token}, "$currentDate": {"fecha": True}},
+            upsert=True
+        )
+
+    def _watch(self):
+        collections = self._active_collections()
+        if not collections:
+            time.sleep(self.poll_seconds)
+            return
+        if not self._token_loaded:
+            # Once per process: resume from where the workers last were
+            self._resume_token = self._load_token()
+            self._token_loaded = True
+        pipeline = [
+            {"$match": {"ns.coll": {"$in": collections}}},
+            # Only what the event needs: no document bodies travel over the stream
+            {"$project": {"operationType": 1, "ns": 1, "documentKey": 1,
+                          "updateDescription.updatedFields": 1, "updateDescription.removedFields": 1}},
+        ]
+        with self.db.watch(pipeline, resume_after=self._resume_token) as stream:
+            while stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    self._apply_change(change)
+                    if change['operationType'] == "invalidate":
+                        # The stream is closed; its last token cannot be resumed after
+                        return
+                if stream.resume_token is not None:
+                    self._resume_token = stream.resume_token
+                    self._save_token()
+                if change is None and collections != self._active_collections():
+                    # A region registered for a new collection: reopen with a wider filter
+                    return
+
+    def _apply_change(self, change):
+        operacion = change['operationType']
+        coleccion = change.get('ns', {}).get('coll')
+        if operacion not in DOCUMENT_OPERATIONS:
+            # drop / rename / dropDatabase / invalidate: nothing left to resume from
+            if operacion == "invalidate":
+                self._resume_token = None
+                self._save_token(force=True)
+            self.reload([coleccion] if coleccion in self.collections else None)
+            return
+
+        campos = None
+        if operacion == "update":
+            description = change.get('updateDescription', {})
+            campos = sorted({f.split(".")[0] for f in
+                             list(description.get('updatedFields', {})) + description.get('removedFields', [])})
+            if campos and set(campos) <= IGNORED_FIELDS.get(coleccion, set()):
+                return
+        self.publish(coleccion, operacion, change['documentKey']['_id'], campos)
+
+    # --- Polling fallback ---
+
+    def _poll(self):
+        """
+        Publishes documents whose fecha_actualizacion moved since the last
+        poll. Deletes leave no trace, so a shrinking collection reloads its
+        regions instead.
+        """
+        for coleccion in self._active_collections():
+            if coleccion not in self._watermarks:
+                # First poll: start from the server's clock, which stamped the documents
+                self._watermarks[coleccion] = (self.db.client.admin.command('hello')['localTime'], set())
+                self._counts[coleccion] = self.db[coleccion].estimated_document_count()
+                continue
+
+            since, seen = self._watermarks[coleccion]
+            latest, at_latest = since, set(seen)
+            cursor = self.db[coleccion].find({"fecha_actualizacion": {"$gte": since}},
+                                             {"fecha_actualizacion": 1}).sort("fecha_actualizacion", 1)
+            for doc in cursor:
+                fecha = doc['fecha_actualizacion']
+                # Documents stamped exactly at the previous watermark were already published
+                if fecha == since and doc['_id'] in seen:
+                    continue
+                if fecha > latest:
+                    latest, at_latest = fecha, set()
+                at_latest.add(doc['_id'])
+                self.publish(coleccion, "update", doc['_id'])
+            self._watermarks[coleccion] = (latest, at_latest)
+
+            count = self.db[coleccion].estimated_document_count()
+            if count < self._counts[coleccion]:
+                self.publish(coleccion, "reload")
+            self._counts[coleccion] = count
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Bus de invalidación de cachés.")
+    parser.add_argument("command", choices=["watch"], help="watch: muestra los eventos en vivo")
+    parser.parse_args()
+
+    db = get_database(check=True)
+    if db is not None:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+        # A separate position, so this tool never moves the workers' resume token
+        bus = InvalidationBus(db, name="cli")
+        bus.register("consola", WATCHED_COLLECTIONS,
+                     lambda e: print(f"{e['fecha']:%H:%M:%S} {e['coleccion']} {e['tipo']} {e['id'] or ''} "
+                                     f"{','.join(e['campos'] or [])}"))
+        bus.start()
+        modo = "change streams" if supports_transactions(db.client) else f"sondeo cada {bus.poll_seconds:g}s"
+        print(f"Escuchando cambios en {', '.join(WATCHED_COLLECTIONS)} ({modo}). Ctrl+C para salir.")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,206 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from database import get_database
+import invalidation
+
+logger = logging.getLogger("tienda.inventory")
+
+# Reorder threshold for products without their own `stock_minimo`
+DEFAULT_REORDER_THRESHOLD = int(os.getenv("REORDER_THRESHOLD", "10"))
+# Threshold crossings kept in memory for the admin view
+RECENT_EVENTS = 100
+
+# A product is low on stock when stock < stock_minimo. MongoDB partial indexes
+# cannot compare two fields, so the result is stored as `bajo_stock` and the
+# partial index {bajo_stock: 1, where bajo_stock: true} only holds low products.
+LOW_STOCK_EXPR = {"$lt": ["$stock", {"$ifNull": ["$stock_minimo", DEFAULT_REORDER_THRESHOLD]}]}
+LOW_STOCK_FILTER = {"bajo_stock": True}
+LOW_STOCK_PROJECTION = {"nombre": 1, "sku": 1, "stock": 1, "stock_minimo": 1}
+# Product fields whose changes can move a product in or out of the low-stock set
+STOCK_FIELDS = {"stock", "stock_minimo"}
+
+
+def is_low_stock(product):
+    return product.get('stock', 0) < product.get('stock_minimo', DEFAULT_REORDER_THRESHOLD)
+
+
+def refresh_flags(productos, ids=None, session=None, key="_id"):
+    """
+    Recomputes `bajo_stock` with a pipeline update, for the products whose
+    `key` is in `ids` or for the whole catalog. Called after stock writes
+    (checkout, imports), in the same session as the write.
+    """
+    filtro = {key: {"$in": list(ids)}} if ids is not None else {}
+    productos.update_many(filtro, [{"$set": {"bajo_stock": LOW_STOCK_EXPR}}], session=session)
+
+
+def set_threshold(productos, product_id, stock_minimo):
+    """
+    Changes a product's reorder threshold and its flag in one update.
+    """
+    return productos.update_one({"_id": product_id}, [
+        {"$set": {"stock_minimo": stock_minimo, "fecha_actualizacion": "$$NOW"}},
+        {"$set": {"bajo_stock": LOW_STOCK_EXPR}}
+    ]).matched_count
+
+
+class LowStockMonitor:
+    """
+    Live, in-process set of low-stock products.
+
+    Loaded once from the partial index, then kept current from the productos
+    events of an InvalidationBus (the process's cache bus), so no extra
+    watcher thread or change stream is opened. Every product entering or
+    leaving the set is reported to the registered listeners as an event:
+    {"tipo": "bajo_stock" | "repuesto", "producto": {...}, "fecha": datetime}.
+    """
+
+    def __init__(self, db, bus):
+        self.db = db
+        self.bus = bus
+        self._lock = threading.Lock()
+        self._products = {}
+        self._listeners = [self._log_event]
+        self._recent = deque(maxlen=RECENT_EVENTS)
+        self._started_pid = None
+        bus.register("low_stock", ["productos"], self._handle)
+
+    # --- Public API ---
+
+    def start(self):
+        """
+        Loads the set and starts the bus, once per process. Cheap to call
+        from request handlers after the first time.
+        """
+        if self._started_pid == os.getpid():
+            return
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._products = {}
+        self.bus.start()
+        self._reload()
+
+    def subscribe(self, listener):
+        """
+        Registers `listener(event)`; called from the bus thread.
+        """
+        self._listeners.append(listener)
+
+    def products(self):
+        with self._lock:
+            return sorted(self._products.values(), key=lambda p: (p.get('stock', 0), p.get('nombre', '')))
+
+    def count(self):
+        return len(self._products)
+
+    def recent_events(self):
+        with self._lock:
+            return list(reversed(self._recent))
+
+    # --- Set maintenance ---
+
+    def _emit(self, tipo, product):
+        event = {"tipo": tipo, "producto": product, "fecha": datetime.utcnow()}
+        with self._lock:
+            self._recent.append(event)
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("Low-stock listener failed")
+
+    @staticmethod
+    def _log_event(event):
+        p = event['producto']
+        if event['tipo'] == "bajo_stock":
+            logger.warning("Low stock: %s (%s) has %s units, threshold %s", p.get('nombre'), p.get('sku'),
+                           p.get('stock'), p.get('stock_minimo', DEFAULT_REORDER_THRESHOLD))
+        else:
+            logger.info("Restocked: %s (%s) has %s units", p.get('nombre'), p.get('sku'), p.get('stock'))
+
+    def _apply(self, product_id, doc):
+        """
+        Updates the set from a product's current state (None if deleted)
+        and emits an event when the product crosses its threshold.
+        """
+        low = doc is not None and doc.get('bajo_stock') is True
+        summary = {k: doc[k] for k in ("_id", *LOW_STOCK_PROJECTION) if k in doc} if doc else None
+        previous = None
+        with self._lock:
+            was_low = product_id in self._products
+            if low:
+                self._products[product_id] = summary
+            else:
+                previous = self._products.pop(product_id, None)
+        if low and not was_low:
+            self._emit("bajo_stock", summary)
+        elif not low and was_low:
+            self._emit("repuesto", summary or previous)
+
+    def _reload(self):
+        """
+        Re-reads the whole set through the partial index and applies the differences.
+        """
+        current = {doc['_id']: doc for doc in self.db.productos.find(LOW_STOCK_FILTER, LOW_STOCK_PROJECTION)}
+        for doc in current.values():
+            doc['bajo_stock'] = True
+        with self._lock:
+            gone = [pid for pid in self._products if pid not in current]
+        for pid, doc in current.items():
+            self._apply(pid, doc)
+        for pid in gone:
+            self._apply(pid, None)
+
+    # --- Bus region ---
+
+    def _handle(self, event):
+        """
+        Cache bus handler for productos. The bus skips updates that only touch
+        `bajo_stock`, so the threshold is evaluated here from the product's
+        current stock rather than read from the stored flag.
+        """
+        if self._started_pid != os.getpid():
+            # Not loaded in this process: nothing to keep current
+            return
+        if event['id'] is None:
+            self._reload()
+            return
+        if event['tipo'] == "delete":
+            self._apply(event['id'], None)
+            return
+        if event['campos'] is not None and not STOCK_FIELDS.intersection(event['campos']):
+            return
+        doc = self.db.productos.find_one({"_id": event['id']}, LOW_STOCK_PROJECTION)
+        if doc is not None:
+            doc['bajo_stock'] = is_low_stock(doc)
+        self._apply(event['id'], doc)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Monitor de inventario bajo stock.")
+    parser.add_argument("command", choices=["refresh", "watch"],
+                        help="refresh: recalcula bajo_stock en todo el catálogo; watch: emite eventos en vivo")
+    args = parser.parse_args()
+
+    db = get_database(check=True)
+    if db is not None:
+        if args.command == "refresh":
+            refresh_flags(db.productos)
+            print(f"Productos bajo stock: {db.productos.count_documents(LOW_STOCK_FILTER)}")
+        else:
+            logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+            # Its own bus position, so this tool never moves the workers' resume token
+            monitor = LowStockMonitor(db, invalidation.InvalidationBus(db, name="inventario"))
+            monitor.start()
+            print(f"Vigilando inventario ({monitor.count()} productos bajo stock). Ctrl+C para salir.")
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                pass
@@ -1,79 +1,241 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from database import get_database
+import os
+import io
+from flask import (Flask, Response, render_template, request, redirect, url_for, session, flash,
+                   stream_with_context, abort)
+from database import get_database, check_connection
+from orders import place_order, OutOfStockError, CartAlreadyOrderedError
+from carts import add_item, remove_item, get_cart, cart_summary, CART_PRODUCT_PROJECTION
+import rollups
+import instrumentation
+import assets
+import api
+from sessions import MongoSessionInterface, session_profile, refresh_user_sessions, SESSION_USER_PROJECTION
+from cache import LRUCache
+import recommendations
+import catalog_io
+import indexes
+import inventory
+import invalidation
+import reviews
+from order_numbers import OrderNumberAllocator
+from httpcache import conditional, make_etag
+from catalog import (normalize_text, prefix_filter, AUTOCOMPLETE_MIN_LENGTH, AUTOCOMPLETE_LIMIT,
+                     ListingQuery, CategoryTree, CatalogVersion, encode_cursor, decode_cursor, keyset_filter)
 from bson.objectid import ObjectId
+from bson.errors import InvalidId
 import hashlib
 from datetime import datetime
-import re
 
 app = Flask(__name__)
 app.secret_key = 'super_secret_key_change_me' # Required for session
 
-# Database Connection
+# Per-request Mongo instrumentation (Server-Timing header, /admin/metrics)
+instrumentation.init_app(app)
+
+# Fingerprinted static assets (/assets/) and gzip/brotli compression of HTML
+assets.init_app(app)
+
+# Database Connection (shared pooled client; connects lazily on first query)
 db = get_database()
 
+# Index registry (indexes.py); applied here only when MONGO_AUTO_INDEXES=1
+indexes.apply_on_startup(db)
+
+# Server-side sessions: the cookie holds an id, the data lives in 'sesiones'
+app.session_interface = MongoSessionInterface(db)
+
+# Product detail pages: product + recommendations, keyed by product id.
+# Invalidated in every worker when the product changes (cache_bus below).
+product_page_cache = LRUCache(
+    maxsize=int(os.getenv("PRODUCT_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("PRODUCT_CACHE_TTL", "60"))
+)
+# Reviews are paged from their own collection (reviews.py); this only keeps
+# arrays not yet moved by `python reviews.py` out of the page
+PRODUCT_DETAIL_PROJECTION = {"reseñas": 0}
+
+# Collision-free order numbers, reserved from the counters collection in blocks
+order_numbers = OrderNumberAllocator(db)
+
+# Order history on /dashboard: page size and the summary fields the table shows
+ORDER_HISTORY_PAGE_SIZE = int(os.getenv("ORDER_HISTORY_PAGE_SIZE", "20"))
+ORDER_SUMMARY_PROJECTION = {"numero_pedido": 1, "fecha_pedido": 1, "total": 1, "estado": 1}
+
+# Cached category tree (slug/id lookups, subcategory expansion, top-level list)
+category_tree = CategoryTree(db)
+
+# JSON API (/api/v1): catalog, cart and orders without template rendering
+app.register_blueprint(api.create_blueprint(db, category_tree))
+
+# Catalog-wide version for HTTP validators, bumped after catalog writes
+catalog_version = CatalogVersion(db)
+# product id -> (product version, catalog version it was last confirmed at)
+product_versions = LRUCache(maxsize=int(os.getenv("PRODUCT_CACHE_SIZE", "2048")) * 4,
+                            ttl=float(os.getenv("PRODUCT_VERSION_TTL", "3600")))
+
+# Cross-worker invalidation: changes written by any process reach the caches
+# above in every process (started on the first request in each one)
+cache_bus = invalidation.InvalidationBus(db)
+cache_bus.register("product_pages", ["productos"], invalidation.lru_region(product_page_cache))
+cache_bus.register("product_versions", ["productos"], invalidation.lru_region(product_versions))
+cache_bus.register("category_tree", ["categorias"], lambda event: category_tree.invalidate())
+cache_bus.register("catalog_version", ["productos", "categorias"], lambda event: catalog_version.invalidate())
+
+# Live low-stock set, fed by the same bus (loaded on the first admin request in each process)
+low_stock_monitor = inventory.LowStockMonitor(db, cache_bus)
+
+@app.before_request
+def start_cache_bus():
+    cache_bus.start()
+
+# Version of the recommendation cards (recommendations.VERSION_ID): product
+# pages embed other products' names and prices, so their ETags and cached
+# entries depend on it as well as on the product's own version
+recommendations_version = CatalogVersion(db, counter_id=recommendations.VERSION_ID)
+
+def get_product_page(product_id):
+    """
+    (cached page or None, current recommendations version). Entries built
+    under an older version are ignored: their recommendations may be stale.
+    """
+    version = recommendations_version.current()[0]
+    cached = product_page_cache.get(product_id)
+    if cached is not None and cached[-1] == version:
+        return cached[:-1], version
+    return None, version
+
+# --- Conditional GET validators ---
+def index_validators():
+    version, modified = catalog_version.current()
+    return make_etag("index", version, request.full_path), modified
+
+def product_validators(product_id):
+    """
+    Product pages are validated against the product's own version. It is
+    re-read (a single-field _id lookup) only after the catalog version moved,
+    and a changed version also drops this worker's cached page.
+    """
+    version, modified = catalog_version.current()
+    known = product_versions.get(product_id)
+    if known is None or known[1] != version:
+        try:
+            doc = db.productos.find_one({"_id": ObjectId(product_id)}, {"version": 1})
+        except InvalidId:
+            return None
+        if doc is None:
+            return None
+        if known is None or known[0] != doc.get('version', 0):
+            product_page_cache.invalidate(product_id)
+        known = (doc.get('version', 0), version)
+        product_versions.set(product_id, known)
+    return make_etag("product", product_id, known[0], recommendations_version.current()[0]), modified
+
 # --- Helpers ---
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
-def get_user_by_email(email):
+def get_user_by_email(email, projection=None):
     if db is None: return None
-    return db.usuarios.find_one({"email": email})
+    return db.usuarios.find_one({"email": email}, projection)
 
 # --- Routes ---
 
+@app.route('/health')
+def health():
+    if check_connection():
+        return {"status": "ok"}
+    return {"status": "unavailable"}, 503
+
 @app.route('/')
+@conditional(index_validators)
 def index():
     if db is None:
         return "Database Connection Error", 500
     
-    # Search and Filter Logic
-    query = request.args.get('q')
-    category_slug = request.args.get('category')
-    
-    filter_criteria = {"visible": True}
-    
-    if query:
-        # Case-insensitive regex search
-        regex = re.compile(f".*{re.escape(query)}.*", re.IGNORECASE)
-        filter_criteria["$or"] = [
-            {"nombre": regex},
-            {"descripcion": regex}
-        ]
-    
-    if category_slug:
-        # Find category ID first
-        cat = db.categorias.find_one({"slug": category_slug})
-        if cat:
-            # Include subcategories if any (simplified: just direct match or parent match)
-            # For now, just direct match on category.id or parent_id logic if implemented fully
-            # The model stores {id: ObjectId, nombre: String} in product.categoria
-            # We need to match product.categoria.id == cat._id OR product.categoria.id IN subcategories
-            
-            # Find all subcategories IDs
-            subcats = list(db.categorias.find({"parent_id": cat['_id']}))
-            cat_ids = [cat['_id']] + [sc['_id'] for sc in subcats]
-            
-            filter_criteria["categoria.id"] = {"$in": cat_ids}
+    # Search, category filter, sort and pagination
+    listing = ListingQuery(request.args, category_tree)
+    products = list(listing.apply(db.productos.find(listing.filter, listing.projection)))
+    products, next_args = listing.paginate(products, request.args)
+    next_url = url_for('index', **next_args) if next_args else None
 
-    products = list(db.productos.find(filter_criteria))
-    categories = list(db.categorias.find({"parent_id": None})) # Top level categories for dropdown
+    categories = category_tree.top_level() # Top level categories for dropdown
     
-    return render_template('index.html', products=products, categories=categories)
+    return render_template('index.html', products=products, categories=categories,
+                           sort_option=listing.sort_option, next_url=next_url)
+
+@app.route('/search/suggest')
+def search_suggest():
+    query = (request.args.get('q') or '').strip()
+    if len(query) < AUTOCOMPLETE_MIN_LENGTH:
+        return {"suggestions": []}
+
+    prefix = prefix_filter(query)
+    if not prefix:
+        return {"suggestions": []}
+    prefix["visible"] = True
+
+    cursor = db.productos.find(prefix, {"nombre": 1}).sort("nombre_normalizado", 1).limit(AUTOCOMPLETE_LIMIT)
+    return {"suggestions": [{"id": str(p['_id']), "nombre": p['nombre']} for p in cursor]}
 
 @app.route('/product/<product_id>')
+@conditional(product_validators)
 def product_details(product_id):
-    product = db.productos.find_one({"_id": ObjectId(product_id)})
-    if not product:
-        flash('Producto no encontrado', 'error')
-        return redirect('/')
-    
-    # Recommendations: Same category, exclude current
-    recommendations = list(db.productos.find({
-        "categoria.id": product['categoria']['id'],
-        "_id": {"$ne": product['_id']}
-    }).limit(4))
-    
-    return render_template('product_details.html', product=product, recommendations=recommendations)
+    recommendations.start_background_refresh(db)
+
+    # Read-through cache: hot product pages are served without touching MongoDB
+    cached, recs_version = get_product_page(product_id)
+    if cached is None:
+        product = db.productos.find_one({"_id": ObjectId(product_id)}, PRODUCT_DETAIL_PROJECTION)
+        if not product:
+            flash('Producto no encontrado', 'error')
+            return redirect('/')
+        
+        # Recommendations: precomputed co-purchases, same category as fallback
+        recs = recommendations.get_recommendations(db, product)
+        # First page of reviews; later pages come from /product/<id>/reviews
+        cached = (product, recs, *reviews.get_reviews(db, product['_id']))
+        product_page_cache.set(product_id, (*cached, recs_version))
+    
+    product, recs, product_reviews, reviews_next = cached
+    # GET pages further reviews, POST publishes one (same URL)
+    return render_template('product_details.html', product=product, recommendations=recs,
+                           reviews=product_reviews, reviews_next=reviews_next,
+                           reviews_url=url_for('product_reviews', product_id=product_id))
+
+def review_json(review):
+    return {"autor": review.get('autor', ''), "calificacion": review['calificacion'],
+            "comentario": review.get('comentario', ''), "fecha": review['fecha'].strftime('%Y-%m-%d')}
+
+@app.route('/product/<product_id>/reviews')
+def product_reviews(product_id):
+    try:
+        oid = ObjectId(product_id)
+    except InvalidId:
+        abort(404)
+    page, next_cursor = reviews.get_reviews(db, oid, after=request.args.get('after'))
+    return {"reviews": [review_json(r) for r in page], "next": next_cursor}
+
+@app.route('/product/<product_id>/reviews', methods=['POST'])
+def add_product_review(product_id):
+    if 'user' not in session:
+        flash('Debes iniciar sesión para publicar una reseña', 'error')
+        return redirect('/login')
+    try:
+        oid = ObjectId(product_id)
+    except InvalidId:
+        abort(404)
+
+    try:
+        reviews.add_review(db, oid, session['user'],
+                           request.form.get('calificacion'), request.form.get('comentario'))
+    except reviews.ReviewError as e:
+        flash(str(e), 'error')
+    else:
+        # The cached page holds the rating summary and the first reviews
+        product_page_cache.invalidate(product_id)
+        catalog_version.bump()
+        flash('¡Gracias por tu reseña!', 'success')
+    return redirect(url_for('product_details', product_id=product_id))
 
 # --- Cart Routes ---
 
@@ -84,27 +246,21 @@ def view_cart():
         return redirect('/login')
     
     user_id = ObjectId(session['user']['id'])
-    
-    # Fetch cart from DB
-    # Note: Model says "carrito_actual" in User, or "Carritos" collection.
-    # Let's use Carritos collection: {cliente_id: ..., items: [...]}
-    cart = db.carritos.find_one({"cliente_id": user_id})
-    
-    cart_items = []
-    total = 0
-    
-    if cart:
-        cart_items = cart['items']
-        # Calculate total dynamically or trust DB? Let's recalc for display
-        for item in cart_items:
-            total += item['precio_unitario'] * item['cantidad']
-            # Convert ObjectId to string for template-friendly URLs
-            try:
-                item['producto_id_str'] = str(item.get('producto_id'))
-            except Exception:
-                item['producto_id_str'] = item.get('producto_id')
-            
-    return render_template('cart.html', cart_items=cart_items, total=total)
+    # subtotal and line totals are stored on the cart by every add/remove
+    cart = get_cart(db.carritos, user_id)
+
+    cart_items = cart['items'] if cart else []
+    for item in cart_items:
+        # String id for template-friendly URLs
+        item['producto_id_str'] = str(item['producto_id'])
+
+    return render_template('cart.html', cart_items=cart_items, total=cart['subtotal'] if cart else 0)
+
+@app.route('/cart/summary')
+def cart_summary_view():
+    if 'user' not in session:
+        return {"error": "auth_required"}, 401
+    return cart_summary(db.carritos, ObjectId(session['user']['id']))
 
 @app.route('/cart/add/<product_id>')
 def add_to_cart(product_id):
@@ -115,49 +271,18 @@ def add_to_cart(product_id):
         return redirect('/login')
     
     user_id = ObjectId(session['user']['id'])
-    product = db.productos.find_one({"_id": ObjectId(product_id)})
+    product = db.productos.find_one({"_id": ObjectId(product_id)}, CART_PRODUCT_PROJECTION)
     
     if not product:
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return {"error": "product_not_found"}, 404
         return redirect('/')
 
-    cart = db.carritos.find_one({"cliente_id": user_id})
-    
-    item_data = {
-        "producto_id": product['_id'],
-        "nombre": product['nombre'],
-        "sku": product.get('sku', ''),
-        "cantidad": 1,
-        "precio_unitario": product['precio'],
-        "atributos": {} 
-    }
-
-    if cart:
-        existing_item = next((item for item in cart['items'] if item['producto_id'] == product['_id']), None)
-        
-        if existing_item:
-            db.carritos.update_one(
-                {"_id": cart['_id'], "items.producto_id": product['_id']},
-                {"$inc": {"items.$.cantidad": 1}}
-            )
-        else:
-            db.carritos.update_one(
-                {"_id": cart['_id']},
-                {"$push": {"items": item_data}}
-            )
-    else:
-        new_cart = {
-            "cliente_id": user_id,
-            "items": [item_data],
-            "subtotal": 0, 
-            "descuentos": [],
-            "fecha_actualizacion": datetime.utcnow()
-        }
-        db.carritos.insert_one(new_cart)
+    # Increment-or-push in one atomic upsert on carritos (totals included)
+    summary = add_item(db.carritos, user_id, product)
         
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return {"success": True, "message": "Producto agregado"}
+        return {"success": True, "message": "Producto agregado", "cart": summary}
         
     flash('Producto agregado al carrito', 'success')
     return redirect('/cart')
@@ -168,10 +293,7 @@ def remove_from_cart(product_id):
         return redirect('/login')
         
     user_id = ObjectId(session['user']['id'])
-    db.carritos.update_one(
-        {"cliente_id": user_id},
-        {"$pull": {"items": {"producto_id": ObjectId(product_id)}}}
-    )
+    remove_item(db.carritos, user_id, ObjectId(product_id))
     return redirect('/cart')
 
 @app.route('/checkout', methods=['POST'])
@@ -180,51 +302,53 @@ def checkout():
         return redirect('/login')
     
     user_id = ObjectId(session['user']['id'])
-    cart = db.carritos.find_one({"cliente_id": user_id})
+    cart = get_cart(db.carritos, user_id)
     
     if not cart or not cart['items']:
         flash('El carrito está vacío', 'error')
         return redirect('/cart')
         
-    # Calculate totals
-    total = 0
-    items_snapshot = []
+    # Shipping address comes from the session profile (kept current by
+    # sessions.refresh_user_sessions), so checkout does not re-read usuarios
     
-    for item in cart['items']:
-        total += item['precio_unitario'] * item['cantidad']
-        items_snapshot.append(item)
-        
-        # Decrease stock
-        db.productos.update_one(
-            {"_id": item['producto_id']},
-            {"$inc": {"stock": -item['cantidad']}}
-        )
-    
-    user = db.usuarios.find_one({"_id": user_id})
-    if not user:
-        # If session references a user that no longer exists in DB, stop checkout
-        flash('No se encontró el usuario. Por favor inicia sesión de nuevo.', 'error')
-        return redirect('/login')
+    # Totals were maintained on the cart with each add/remove
+    items_snapshot = list(cart['items'])
+    total = cart['subtotal']
     
     # Create Order
     new_order = {
         "usuario_id": user_id,
-        "numero_pedido": f"ORD-{int(datetime.utcnow().timestamp())}",
+        "numero_pedido": order_numbers.next_number(),
         "items": items_snapshot,
         "subtotal": total,
         "impuestos": 0,
         "descuentos": 0,
         "total": total,
         "estado": "CREADO",
-        "direccion_envio": user.get('direcciones', [{}])[0] if user.get('direcciones') else {},
+        "direccion_envio": session['user'].get('direccion', {}),
         "pago": {"metodo": "simulado", "estado": "pendiente", "fecha": datetime.utcnow()},
         "fecha_pedido": datetime.utcnow()
     }
     
-    order_id = db.pedidos.insert_one(new_order).inserted_id
+    # Claim the cart, reserve stock and insert the order atomically
+    try:
+        order_id = place_order(db, cart, new_order)
+    except OutOfStockError as e:
+        if e.items:
+            detalle = ', '.join(f"{i['nombre']} (disponible: {i['disponible']})" for i in e.items)
+            flash(f'Stock insuficiente para: {detalle}', 'error')
+        else:
+            # Stock came back between the failed reservation and the re-read
+            flash('Stock insuficiente para completar el pedido. Inténtalo de nuevo.', 'error')
+        return redirect('/cart')
+    except CartAlreadyOrderedError:
+        flash('Este carrito ya fue procesado como pedido', 'error')
+        return redirect('/dashboard')
     
-    # Clear Cart
-    db.carritos.delete_one({"_id": cart['_id']})
+    # Stock changed: drop cached product pages for what was just bought
+    for item in items_snapshot:
+        product_page_cache.invalidate(str(item['producto_id']))
+    catalog_version.bump()
     
     flash('¡Pedido realizado con éxito!', 'success')
     return redirect(url_for('order_details', order_id=str(order_id)))
@@ -264,15 +388,12 @@ def login():
         password = request.form['password']
         hashed_pw = hash_password(password)
         
-        user = get_user_by_email(email)
+        user = get_user_by_email(email, {"password": 1, **SESSION_USER_PROJECTION})
         
         if user and user['password'] == hashed_pw:
-            session['user'] = {
-                'id': str(user['_id']),
-                'nombre': user['nombre'],
-                'email': user['email'],
-                'role': user.get('role', 'customer')
-            }
+            # New session id on login: anonymous data and ids are never promoted
+            session.regenerate()
+            session['user'] = session_profile(user)
             flash('Bienvenido!', 'success')
             return redirect('/')
         else:
@@ -288,7 +409,7 @@ def register():
         password = request.form['password']
         telefono = request.form['telefono']
         
-        if get_user_by_email(email):
+        if get_user_by_email(email, {"_id": 1}):
             flash('El email ya está registrado', 'error')
             return redirect(url_for('register'))
             
@@ -303,7 +424,9 @@ def register():
             "estado": "activo"
         }
         
-        db.usuarios.insert_one(new_user)
+        user_id = db.usuarios.insert_one(new_user).inserted_id
+        # Every write to usuarios goes through the session hook
+        refresh_user_sessions(db, user_id)
         flash('Cuenta creada exitosamente. Por favor inicia sesión.', 'success')
         return redirect(url_for('login'))
         
@@ -311,7 +434,7 @@ def register():
 
 @app.route('/logout')
 def logout():
-    session.pop('user', None)
+    session.regenerate()
     return redirect('/')
 
 @app.route('/dashboard')
@@ -320,23 +443,33 @@ def dashboard():
         return redirect('/login')
     
     user_id = ObjectId(session['user']['id'])
-    pedidos = list(db.pedidos.find({"usuario_id": user_id}))
 
-    # Add string IDs and formatted date to each pedido for template safety
+    # Newest first, keyset-paginated on (fecha_pedido, _id) over the
+    # {usuario_id, fecha_pedido, _id} index; one extra row detects the next page
+    filtro = {"usuario_id": user_id}
+    before = decode_cursor(request.args.get('before'))
+    if before:
+        filtro.update(keyset_filter('fecha_pedido', -1, before))
+    cursor = db.pedidos.find(filtro, ORDER_SUMMARY_PROJECTION) \
+        .sort([("fecha_pedido", -1), ("_id", -1)]).limit(ORDER_HISTORY_PAGE_SIZE + 1)
+    pedidos = list(cursor)
+
+    next_url = None
+    if len(pedidos) > ORDER_HISTORY_PAGE_SIZE:
+        pedidos = pedidos[:ORDER_HISTORY_PAGE_SIZE]
+        next_url = url_for('dashboard', before=encode_cursor(pedidos[-1], 'fecha_pedido'))
+
     for p in pedidos:
-        try:
-            p['pedido_id_str'] = str(p.get('_id'))
-        except Exception:
-            p['pedido_id_str'] = p.get('_id')
+        p['pedido_id_str'] = str(p['_id'])
         fecha = p.get('fecha_pedido')
-        try:
-            p['fecha_str'] = fecha.strftime('%Y-%m-%d') if fecha else ''
-        except Exception:
-            p['fecha_str'] = ''
-        # Ensure total exists
+        p['fecha_str'] = fecha.strftime('%Y-%m-%d') if fecha else ''
         p['total_display'] = p.get('total', 0)
 
-    return render_template('dashboard.html', pedidos=pedidos)
+    lifetime_total, order_count = rollups.get_customer_totals(db, user_id)
+
+    return render_template('dashboard.html', pedidos=pedidos, next_url=next_url,
+                           is_first_page=before is None,
+                           order_count=order_count, lifetime_total=lifetime_total)
 
 @app.route('/admin')
 def admin():
@@ -344,18 +477,14 @@ def admin():
         flash('Acceso denegado. Se requieren permisos de administrador.', 'error')
         return redirect('/')
     
-    # Analytics
-    pipeline_sales = [
-        {"$group": {"_id": None, "total": {"$sum": "$total"}}}
-    ]
-    sales_result = list(db.pedidos.aggregate(pipeline_sales))
-    total_sales = sales_result[0]['total'] if sales_result else 0
-    
-    total_orders = db.pedidos.count_documents({})
-    low_stock_count = db.productos.count_documents({"stock": {"$lt": 10}})
+    # Analytics (precomputed in the sales rollups at checkout)
+    total_sales, total_orders = rollups.get_totals(db)
+    # Maintained in memory by the inventory watcher: no query at page load
+    low_stock_monitor.start()
+    low_stock_count = low_stock_monitor.count()
     
     recent_orders = list(db.pedidos.find().sort("fecha_pedido", -1).limit(10))
-    categorias = list(db.categorias.find())
+    categorias = category_tree.all()
     
     return render_template('admin.html', 
                            categorias=categorias,
@@ -371,74 +500,30 @@ def admin_analytics():
         flash('Acceso denegado. Se requieren permisos de administrador.', 'error')
         return redirect('/')
 
-    # Total sales (revenue) - reuse approach from /admin
-    pipeline_sales = [{"$group": {"_id": None, "total": {"$sum": "$total"}}}]
-    sales_result = list(db.pedidos.aggregate(pipeline_sales))
-    total_sales = sales_result[0]['total'] if sales_result else 0
+    # Total sales (revenue) - precomputed rollup, same as /admin
+    total_sales, _ = rollups.get_totals(db)
 
     # Number of registered customers (role == 'customer')
     num_customers = db.usuarios.count_documents({"role": "customer"})
 
-    # Top products by quantity and revenue
-    prod_pipeline = [
-        {"$unwind": "$items"},
-        {"$group": {
-            "_id": "$items.producto_id",
-            "quantity": {"$sum": "$items.cantidad"},
-            "revenue": {"$sum": {"$multiply": ["$items.cantidad", "$items.precio_unitario"]}}
-        }},
-        {"$sort": {"quantity": -1}},
-        {"$limit": 5}
-    ]
-    top_aggr = list(db.pedidos.aggregate(prod_pipeline))
-
-    top_products = []
-    for row in top_aggr:
-        try:
-            prod = db.productos.find_one({"_id": row['_id']})
-            top_products.append({
-                "_id": str(row['_id']),
-                "nombre": prod['nombre'] if prod else 'Desconocido',
-                "quantity": int(row.get('quantity', 0)),
-                "revenue": int(row.get('revenue', 0))
-            })
-        except Exception:
-            top_products.append({
-                "_id": str(row['_id']),
-                "nombre": 'Desconocido',
-                "quantity": int(row.get('quantity', 0)),
-                "revenue": int(row.get('revenue', 0))
-            })
+    # Top products by quantity and revenue (names joined in the same pipeline)
+    top_aggr = rollups.get_top_products(db, limit=5)
+
+    top_products = [{
+        "_id": str(row['_id']),
+        "nombre": row.get('nombre') or 'Desconocido',
+        "quantity": int(row.get('quantity', 0)),
+        "revenue": int(row.get('revenue', 0))
+    } for row in top_aggr]
 
     best_product = top_products[0] if top_products else None
 
     # Category with most sales (by revenue)
-    cat_pipeline = [
-        {"$unwind": "$items"},
-        {"$lookup": {
-            "from": "productos",
-            "localField": "items.producto_id",
-            "foreignField": "_id",
-            "as": "prod"
-        }},
-        {"$unwind": "$prod"},
-        {"$group": {
-            "_id": "$prod.categoria.id",
-            "quantity": {"$sum": "$items.cantidad"},
-            "revenue": {"$sum": {"$multiply": ["$items.cantidad", "$items.precio_unitario"]}}
-        }},
-        {"$sort": {"revenue": -1}},
-        {"$limit": 1}
-    ]
-    cat_aggr = list(db.pedidos.aggregate(cat_pipeline))
+    cat_row = rollups.get_top_category(db)
     top_category = None
-    if cat_aggr:
-        cat_row = cat_aggr[0]
-        cat_doc = None
-        try:
-            cat_doc = db.categorias.find_one({"_id": cat_row['_id']})
-        except Exception:
-            cat_doc = None
+    if cat_row:
+        # Category names come from the cached tree: no extra round-trip
+        cat_doc = category_tree.get(cat_row['_id'])
         top_category = {
             "_id": str(cat_row['_id']) if cat_row.get('_id') else None,
             "nombre": cat_doc['nombre'] if cat_doc else 'Desconocida',
@@ -446,16 +531,8 @@ def admin_analytics():
             "revenue": int(cat_row.get('revenue', 0))
         }
 
-    # Sales by month (YYYY-MM) — sum totals per month
-    month_pipeline = [
-        {"$match": {"fecha_pedido": {"$exists": True}}},
-        {"$group": {
-            "_id": {"$dateToString": {"format": "%Y-%m", "date": "$fecha_pedido"}},
-            "total": {"$sum": "$total"}
-        }},
-        {"$sort": {"_id": 1}}
-    ]
-    month_aggr = list(db.pedidos.aggregate(month_pipeline))
+    # Sales by month (YYYY-MM) — one rollup document per month
+    month_aggr = rollups.get_monthly(db)
     sales_by_month = [{"month": m['_id'], "total": int(m['total'])} for m in month_aggr]
 
     return render_template('analytics.html',
@@ -466,6 +543,16 @@ def admin_analytics():
                            top_category=top_category,
                            sales_by_month=sales_by_month)
 
+@app.route('/admin/metrics')
+def admin_metrics():
+    if 'user' not in session or session['user']['role'] != 'admin':
+        return {"error": "forbidden"}, 403
+
+    if request.args.get('reset'):
+        instrumentation.route_metrics.reset()
+    return {"slow_query_ms": instrumentation.SLOW_QUERY_MS,
+            "routes": instrumentation.route_metrics.snapshot()}
+
 @app.route('/admin/add_product', methods=['POST'])
 def add_product():
     if 'user' not in session or session['user']['role'] != 'admin':
@@ -476,10 +563,15 @@ def add_product():
     descripcion = request.form['descripcion']
     precio = int(request.form['precio'])
     stock = int(request.form['stock'])
+    stock_minimo = request.form.get('stock_minimo', type=int)
     categoria_id = request.form['categoria_id']
     imagen_url = request.form.get('imagen_url')
     
-    cat = db.categorias.find_one({"_id": ObjectId(categoria_id)})
+    cat = category_tree.get(ObjectId(categoria_id))
+    if cat is None:
+        # Category created since the tree was cached: refresh once
+        category_tree.invalidate()
+        cat = category_tree.get(ObjectId(categoria_id))
     
     new_product = {
         "sku": sku,
@@ -491,17 +583,110 @@ def add_product():
         "stock": stock,
         "imagenes": [imagen_url] if imagen_url else [],
         "fecha_creacion": datetime.utcnow(),
+        "fecha_actualizacion": datetime.utcnow(),
         "visible": True,
-        "reseñas": []
+        "nombre_normalizado": normalize_text(nombre),
+        "version": 1,
+        **reviews.EMPTY_RATING
     }
+    if stock_minimo is not None:
+        new_product["stock_minimo"] = stock_minimo
+    new_product["bajo_stock"] = inventory.is_low_stock(new_product)
     
     try:
         db.productos.insert_one(new_product)
+        catalog_version.bump()
+        # Same-category fallback recommendations may now include it
+        recommendations.bump_version(db)
         flash('Producto agregado correctamente', 'success')
     except Exception as e:
         flash(f'Error al agregar producto: {str(e)}', 'error')
         
     return redirect('/admin')
 
+@app.route('/admin/inventory')
+def admin_inventory():
+    if 'user' not in session or session['user']['role'] != 'admin':
+        flash('Acceso denegado. Se requieren permisos de administrador.', 'error')
+        return redirect('/')
+
+    low_stock_monitor.start()
+    return render_template('inventory.html',
+                           products=low_stock_monitor.products(),
+                           events=low_stock_monitor.recent_events(),
+                           default_threshold=inventory.DEFAULT_REORDER_THRESHOLD)
+
+@app.route('/admin/api/low-stock')
+def admin_low_stock_api():
+    if 'user' not in session or session['user']['role'] != 'admin':
+        return {"error": "forbidden"}, 403
+
+    low_stock_monitor.start()
+    def as_json(p):
+        return {"id": str(p['_id']), "nombre": p.get('nombre'), "sku": p.get('sku'), "stock": p.get('stock'),
+                "stock_minimo": p.get('stock_minimo', inventory.DEFAULT_REORDER_THRESHOLD)}
+    return {
+        "count": low_stock_monitor.count(),
+        "products": [as_json(p) for p in low_stock_monitor.products()],
+        "events": [{"tipo": e['tipo'], "fecha": e['fecha'].isoformat(), "producto": as_json(e['producto'])}
+                   for e in low_stock_monitor.recent_events()]
+    }
+
+@app.route('/admin/inventory/<product_id>/threshold', methods=['POST'])
+def admin_set_threshold(product_id):
+    if 'user' not in session or session['user']['role'] != 'admin':
+        return redirect('/')
+
+    stock_minimo = request.form.get('stock_minimo', type=int)
+    if stock_minimo is None or stock_minimo < 0:
+        flash('El stock mínimo debe ser un entero no negativo', 'error')
+    elif inventory.set_threshold(db.productos, ObjectId(product_id), stock_minimo):
+        flash('Stock mínimo actualizado', 'success')
+    else:
+        flash('Producto no encontrado', 'error')
+    return redirect(url_for('admin_inventory'))
+
+@app.route('/admin/import', methods=['POST'])
+def admin_import():
+    if 'user' not in session or session['user']['role'] != 'admin':
+        return redirect('/')
+
+    archivo = request.files.get('archivo')
+    if not archivo or not archivo.filename:
+        flash('Selecciona un archivo CSV o JSON Lines', 'error')
+        return redirect('/admin')
+
+    fmt = 'jsonl' if archivo.filename.endswith(('.jsonl', '.ndjson')) else 'csv'
+    batch_size = request.form.get('batch_size', catalog_io.DEFAULT_BATCH_SIZE, type=int)
+    # Read the upload as a text stream: rows are processed batch by batch.
+    # utf-8-sig drops the BOM Excel writes, which would otherwise end up in the first header
+    stream = io.TextIOWrapper(archivo.stream, encoding='utf-8-sig', newline='')
+    try:
+        stats = catalog_io.import_products(db, stream, fmt, batch_size, categories=category_tree)
+    except ValueError as e:
+        flash(f'Error al importar: {str(e)}', 'error')
+        return redirect('/admin')
+
+    # Prices and stock may have changed
+    product_page_cache.clear()
+
+    flash(f"Importación: {stats['rows']} filas ({stats['rows_per_sec']} filas/s), "
+          f"{stats['upserted']} nuevos, {stats['modified']} actualizados, "
+          f"{stats['invalid'] + stats['failed']} con errores", 'success')
+    for err in stats['errors'][:5]:
+        flash(f"Fila {err['fila']}: {err['error']}" if err['fila'] else err['error'], 'error')
+    return redirect('/admin')
+
+@app.route('/admin/export')
+def admin_export():
+    if 'user' not in session or session['user']['role'] != 'admin':
+        return redirect('/')
+
+    fmt = 'jsonl' if request.args.get('format') == 'jsonl' else 'csv'
+    mimetype = 'application/x-ndjson' if fmt == 'jsonl' else 'text/csv'
+    chunks = catalog_io.export_products(db, fmt, categories=category_tree)
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=productos.{fmt}'})
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,66 @@
+import os
+import threading
+from pymongo import ReturnDocument
+
+# Counters live in one small collection: {_id: counter name, valor: last reserved number}
+COUNTERS_COLLECTION = "counters"
+# Numbers reserved per round-trip; a process that exits leaves at most this many unused
+ORDER_NUMBER_BLOCK = int(os.getenv("ORDER_NUMBER_BLOCK", "100"))
+ORDER_NUMBER_PREFIX = os.getenv("ORDER_NUMBER_PREFIX", "ORD")
+
+
+class BlockAllocator:
+    """
+    Unique, increasing-per-process numbers from a shared counter.
+
+    Each process reserves a block of `block_size` numbers with a single atomic
+    find_one_and_update ($inc) and hands them out from memory, so only one in
+    every `block_size` allocations touches MongoDB. Blocks never overlap
+    across processes; numbers are unique but not gap-free, and orders from
+    different workers interleave rather than follow creation time.
+    """
+
+    def __init__(self, db, name, block_size=ORDER_NUMBER_BLOCK):
+        self.db = db
+        self.name = name
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._next = 0
+        self._limit = 0
+
+    def _reserve_block(self):
+        counter = self.db[COUNTERS_COLLECTION].find_one_and_update(
+            {"_id": self.name},
+            {"$inc": {"valor": self.block_size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._limit = counter['valor']
+        self._next = self._limit - self.block_size + 1
+        self._pid = os.getpid()
+
+    def next(self):
+        with self._lock:
+            # A forked child must not reuse the block it inherited from its parent
+            if self._pid != os.getpid() or self._next > self._limit:
+                self._reserve_block()
+            value = self._next
+            self._next += 1
+            return value
+
+
+def format_order_number(value, prefix=ORDER_NUMBER_PREFIX):
+    return f"{prefix}-{value:08d}"
+
+
+class OrderNumberAllocator(BlockAllocator):
+    """
+    Allocator for pedidos.numero_pedido (unique index in indexes.py).
+    """
+
+    def __init__(self, db, block_size=ORDER_NUMBER_BLOCK):
+        super().__init__(db, "numero_pedido", block_size)
+
+    def next_number(self):
+        return format_order_number(self.next())
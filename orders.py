@@ -0,0 +1,150 @@
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from database import supports_transactions
+import inventory
+import rollups
+
+
+class OutOfStockError(Exception):
+    """
+    Raised when the cart asks for more units than a product has in stock.
+    `items` lists {"producto_id", "nombre", "solicitado", "disponible"} per short product.
+    """
+
+    def __init__(self, items):
+        super().__init__("Stock insuficiente")
+        self.items = items
+
+
+class CartAlreadyOrderedError(Exception):
+    """
+    Raised when the cart was already turned into an order (double submit,
+    checkout from two tabs): only the first checkout claims it.
+    """
+
+
+def cart_quantities(items):
+    """
+    Merges cart lines into {producto_id: cantidad}, keeping cart order.
+    """
+    quantities = {}
+    for item in items:
+        quantities[item['producto_id']] = quantities.get(item['producto_id'], 0) + item['cantidad']
+    return quantities
+
+
+def find_shortages(productos, items, quantities, session=None):
+    """
+    Returns the cart products whose stock cannot cover the requested quantity.
+    """
+    names = {item['producto_id']: item.get('nombre', '') for item in items}
+    stock = {
+        p['_id']: p.get('stock', 0)
+        for p in productos.find({"_id": {"$in": list(quantities)}}, {"stock": 1}, session=session)
+    }
+    return [
+        {"producto_id": pid, "nombre": names.get(pid, ''), "solicitado": qty, "disponible": stock.get(pid, 0)}
+        for pid, qty in quantities.items()
+        if stock.get(pid, 0) < qty
+    ]
+
+
+def _reserve(productos, quantities, session=None, token=None):
+    """
+    One bulk_write of conditional decrements: a line only applies if stock >= cantidad.
+    When `token` is given it is pushed onto each decremented product so a
+    compensating release can tell which decrements actually happened.
+    """
+    ops = []
+    for pid, qty in quantities.items():
+        # `version` feeds the product page ETag (see httpcache.py), fecha_actualizacion
+        # the cache invalidation poller (see invalidation.py)
+        update = {"$inc": {"stock": -qty, "version": 1}, "$currentDate": {"fecha_actualizacion": True}}
+        if token is not None:
+            update["$push"] = {"reservas": token}
+        ops.append(UpdateOne({"_id": pid, "stock": {"$gte": qty}}, update))
+    return productos.bulk_write(ops, ordered=False, session=session).matched_count
+
+
+def _release(productos, quantities, token):
+    """
+    Compensating rollback for the standalone path: restores stock only on
+    products that carry this reservation's token.
+    """
+    ops = [
+        UpdateOne({"_id": pid, "reservas": token}, {"$inc": {"stock": qty, "version": 1}, "$pull": {"reservas": token},
+                                                    "$currentDate": {"fecha_actualizacion": True}})
+        for pid, qty in quantities.items()
+    ]
+    productos.bulk_write(ops, ordered=False)
+
+
+def _confirm(productos, quantities, token):
+    productos.update_many({"_id": {"$in": list(quantities)}}, {"$pull": {"reservas": token}})
+
+
+def _restore_cart(carritos, cart):
+    """
+    Puts back a cart claimed by a checkout that then failed. If the customer
+    already started a new cart meanwhile, that one is kept.
+    """
+    try:
+        carritos.insert_one(cart)
+    except DuplicateKeyError:
+        pass
+
+
+def place_order(db, cart, new_order):
+    """
+    Claims (deletes) the cart, reserves stock for every cart line, inserts
+    `new_order` and folds it into the sales rollups. Low-stock flags of the
+    decremented products are refreshed with the reservation.
+    Runs in a multi-document transaction when the server supports it; on a
+    standalone mongod a failed reservation is compensated instead.
+    Returns the new order id or raises OutOfStockError or
+    CartAlreadyOrderedError (the cart was claimed by another checkout).
+    """
+    quantities = cart_quantities(cart['items'])
+
+    if supports_transactions(db.client):
+        def txn(s):
+            # First write: a concurrent checkout of the same cart conflicts here, and
+            # its retry finds the cart gone instead of placing a second order
+            if db.carritos.delete_one({"_id": cart['_id']}, session=s).deleted_count == 0:
+                raise CartAlreadyOrderedError()
+            if _reserve(db.productos, quantities, session=s) < len(quantities):
+                # Aborts the transaction; shortages are read once it is rolled back
+                raise OutOfStockError([])
+            inventory.refresh_flags(db.productos, quantities, session=s)
+            order_id = db.pedidos.insert_one(new_order, session=s).inserted_id
+            rollups.record_order(db, new_order, session=s)
+            return order_id
+
+        try:
+            with db.client.start_session() as s:
+                return s.with_transaction(txn)
+        except OutOfStockError:
+            raise OutOfStockError(find_shortages(db.productos, cart['items'], quantities))
+
+    # Without transactions the claim is a single atomic delete: only one checkout gets the cart
+    if db.carritos.delete_one({"_id": cart['_id']}).deleted_count == 0:
+        raise CartAlreadyOrderedError()
+
+    token = ObjectId()
+    if _reserve(db.productos, quantities, token=token) < len(quantities):
+        _release(db.productos, quantities, token)
+        _restore_cart(db.carritos, cart)
+        raise OutOfStockError(find_shortages(db.productos, cart['items'], quantities))
+
+    try:
+        order_id = db.pedidos.insert_one(new_order).inserted_id
+    except Exception:
+        _release(db.productos, quantities, token)
+        _restore_cart(db.carritos, cart)
+        raise
+
+    _confirm(db.productos, quantities, token)
+    inventory.refresh_flags(db.productos, quantities)
+    rollups.record_order(db, new_order)
+    return order_id
@@ -0,0 +1,183 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+from catalog import CatalogVersion
+from database import get_database
+
+logger = logging.getLogger("tienda.recommendations")
+
+# Precomputed "customers also bought" lists:
+#   {_id: producto_id, ids: [co-purchased ids, best first], productos: [...], actualizado}
+# `productos` is a snapshot from the last refresh; pages re-read the current
+# fields of `ids` instead, so price or visibility changes show up at once.
+RECOMMENDATIONS_COLLECTION = "recomendaciones"
+RECOMMENDATION_LIMIT = 4
+REFRESH_SECONDS = int(os.getenv("RECOMMENDATIONS_REFRESH_SECONDS", "3600"))
+# Counter (counters collection) bumped whenever recommendation cards may have
+# changed: a refresh, or product names, prices or visibility (imports, new products).
+# Product page ETags and cached pages are tied to it.
+VERSION_ID = "recomendaciones"
+# Lease in the counters collection: {_id, hasta, pid}. The worker that takes it
+# runs the refresh; the others skip that round.
+REFRESH_LEASE_ID = "recomendaciones_refresh"
+
+# Fields the recommendation cards in product_details.html render
+RECOMMENDATION_PROJECTION = {"nombre": 1, "precio": 1, "imagenes": {"$slice": 1}}
+# What pages read from a precomputed list (lists built before `ids` existed only have the snapshot)
+RECOMMENDATION_DOC_PROJECTION = {"ids": 1, "productos._id": 1}
+
+
+def refresh(db):
+    """
+    Rebuilds the lists from co-purchase counts in pedidos.items and $merges
+    them into RECOMMENDATIONS_COLLECTION.
+    """
+    db.pedidos.aggregate([
+        {"$project": {"p": "$items.producto_id", "q": "$items.producto_id"}},
+        {"$unwind": "$p"},
+        {"$unwind": "$q"},
+        {"$match": {"$expr": {"$ne": ["$p", "$q"]}}},
+        {"$group": {"_id": {"p": "$p", "q": "$q"}, "n": {"$sum": 1}}},
+        {"$sort": {"_id.p": 1, "n": -1}},
+        {"$group": {"_id": "$_id.p", "ids": {"$push": "$_id.q"}}},
+        # Keep a few spares in case some co-purchased products are hidden
+        {"$set": {"ids": {"$slice": ["$ids", RECOMMENDATION_LIMIT * 3]}}},
+        {"$lookup": {
+            "from": "productos",
+            "localField": "ids",
+            "foreignField": "_id",
+            "pipeline": [{"$match": {"visible": True}}, {"$project": RECOMMENDATION_PROJECTION}],
+            "as": "productos"
+        }},
+        # $lookup does not preserve the co-purchase order; rebuild it from ids
+        {"$set": {"productos": {"$slice": [{"$filter": {
+            "input": {"$map": {"input": "$ids", "as": "id", "in": {"$first": {"$filter": {
+                "input": "$productos", "as": "r", "cond": {"$eq": ["$$r._id", "$$id"]}
+            }}}}},
+            "as": "r",
+            "cond": {"$ne": ["$$r", None]}
+        }}, RECOMMENDATION_LIMIT]}}},
+        {"$project": {"ids": 1, "productos": 1, "actualizado": "$$NOW"}},
+        {"$merge": {"into": RECOMMENDATIONS_COLLECTION, "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ])
+    bump_version(db)
+
+
+def bump_version(db):
+    """
+    Marks every product page's recommendations as possibly changed.
+    """
+    CatalogVersion(db, counter_id=VERSION_ID).bump()
+
+
+def get_recommendations(db, product):
+    """
+    Precomputed co-purchase list for `product` with each product's current
+    card fields, falling back to other visible products of the same category
+    when there is no sales data yet (or none of the list is visible).
+    """
+    doc = db[RECOMMENDATIONS_COLLECTION].find_one({"_id": product['_id']}, RECOMMENDATION_DOC_PROJECTION)
+    ids = candidate_ids(doc)
+    if ids:
+        recs = in_order(ids, db.productos.find(current_filter(ids), RECOMMENDATION_PROJECTION))
+        if recs:
+            return recs
+
+    fallback = fallback_filter(product)
+    if fallback is None:
+        return []
+    return list(db.productos.find(fallback, RECOMMENDATION_PROJECTION).limit(RECOMMENDATION_LIMIT))
+
+
+def candidate_ids(doc):
+    """
+    Co-purchased product ids of a precomputed list, best first.
+    """
+    if not doc:
+        return []
+    return doc.get('ids') or [p['_id'] for p in doc.get('productos') or []]
+
+
+def current_filter(ids):
+    """
+    One $in lookup for the current card fields of the candidates still visible.
+    """
+    return {"_id": {"$in": ids}, "visible": True}
+
+
+def in_order(ids, docs):
+    """
+    Restores the co-purchase order lost by the $in lookup, up to RECOMMENDATION_LIMIT.
+    """
+    by_id = {doc['_id']: doc for doc in docs}
+    return [by_id[i] for i in ids if i in by_id][:RECOMMENDATION_LIMIT]
+
+
+def fallback_filter(product):
+    """
+    Other visible products of the same category, or None without a category.
+    """
+    categoria_id = (product.get('categoria') or {}).get('id')
+    if categoria_id is None:
+        return None
+    return {"visible": True, "categoria.id": categoria_id, "_id": {"$ne": product['_id']}}
+
+
+_refresher_pid = None
+_refresher_lock = threading.Lock()
+
+
+def acquire_refresh_lease(db, seconds):
+    """
+    Takes the refresh lease for `seconds` if nobody holds it. Only one
+    process per lease period gets True.
+    """
+    now = datetime.utcnow()
+    try:
+        db.counters.update_one(
+            {"_id": REFRESH_LEASE_ID, "$or": [{"hasta": {"$lte": now}}, {"hasta": {"$exists": False}}]},
+            {"$set": {"hasta": now + timedelta(seconds=seconds), "pid": os.getpid()}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The lease document exists and has not expired: another process holds it
+        return False
+    return True
+
+
+def start_background_refresh(db, interval=REFRESH_SECONDS):
+    """
+    Starts (once per process) a daemon thread that calls refresh() every
+    `interval` seconds. The threads of all workers share a lease, so the
+    aggregation over pedidos runs once per interval, not once per worker.
+    A non-positive interval disables it; cron can run
+    `python recommendations.py` instead.
+    """
+    global _refresher_pid
+    if interval <= 0 or _refresher_pid == os.getpid():
+        return
+    with _refresher_lock:
+        if _refresher_pid == os.getpid():
+            return
+        _refresher_pid = os.getpid()
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                if acquire_refresh_lease(db, interval):
+                    refresh(db)
+            except Exception:
+                logger.exception("Recommendation refresh failed")
+
+    threading.Thread(target=loop, name="recommendations-refresh", daemon=True).start()
+
+if __name__ == "__main__":
+    db = get_database(check=True)
+    if db is not None:
+        started = datetime.utcnow()
+        refresh(db)
+        print(f"Recommendations refreshed in {(datetime.utcnow() - started).total_seconds():.1f}s")
@@ -0,0 +1,167 @@
+import os
+from datetime import datetime
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from catalog import encode_cursor, decode_cursor, keyset_filter
+from database import get_database, supports_transactions
+
+# Reviews live in their own collection, one document per review:
+#   {_id, producto_id, usuario_id, autor, calificacion (1-5), comentario, fecha}
+# Products only keep the summary: rating_avg, rating_count, rating_sum.
+REVIEWS_COLLECTION = "resenas"
+REVIEW_PAGE_SIZE = int(os.getenv("REVIEW_PAGE_SIZE", "10"))
+MIN_RATING, MAX_RATING = 1, 5
+MAX_COMMENT_LENGTH = 2000
+
+REVIEW_PROJECTION = {"autor": 1, "calificacion": 1, "comentario": 1, "fecha": 1}
+
+# Rating summary of a product nobody has reviewed yet
+EMPTY_RATING = {"rating_avg": 0, "rating_count": 0, "rating_sum": 0}
+
+
+class ReviewError(ValueError):
+    """
+    Invalid review or second review of the same product by the same user.
+    """
+
+
+def _summary_pipeline(calificacion, count=1):
+    """
+    Pipeline update folding `count` reviews totalling `calificacion` points into
+    the product's rating summary. Computed server-side, so concurrent reviews
+    never overwrite each other's counts.
+    """
+    count_expr = {"$add": [{"$ifNull": ["$rating_count", 0]}, count]}
+    sum_expr = {"$add": [{"$ifNull": ["$rating_sum", 0]}, calificacion]}
+    return [
+        {"$set": {"rating_count": count_expr, "rating_sum": sum_expr,
+                  "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+                  "fecha_actualizacion": "$$NOW"}},
+        {"$set": {"rating_avg": {"$cond": [
+            {"$gt": ["$rating_count", 0]},
+            {"$round": [{"$divide": ["$rating_sum", "$rating_count"]}, 2]},
+            0
+        ]}}}
+    ]
+
+
+def validate(calificacion, comentario):
+    try:
+        calificacion = int(calificacion)
+    except (TypeError, ValueError):
+        raise ReviewError("La calificación debe ser un número entero")
+    if not MIN_RATING <= calificacion <= MAX_RATING:
+        raise ReviewError(f"La calificación debe estar entre {MIN_RATING} y {MAX_RATING}")
+    comentario = (comentario or "").strip()
+    if len(comentario) > MAX_COMMENT_LENGTH:
+        raise ReviewError(f"El comentario no puede superar {MAX_COMMENT_LENGTH} caracteres")
+    return calificacion, comentario
+
+
+def add_review(db, product_id, user, calificacion, comentario):
+    """
+    Inserts a review and folds it into the product's rating summary, in one
+    transaction when the server supports it. `user` is the session profile.
+    Raises ReviewError if the input is invalid, the product does not exist or
+    is hidden, or the user already reviewed it.
+    """
+    calificacion, comentario = validate(calificacion, comentario)
+    review = {
+        "producto_id": product_id,
+        "usuario_id": ObjectId(user['id']),
+        "autor": user.get('nombre', ''),
+        "calificacion": calificacion,
+        "comentario": comentario,
+        "fecha": datetime.utcnow()
+    }
+
+    def write(s=None):
+        db[REVIEWS_COLLECTION].insert_one(review, session=s)
+        matched = db.productos.update_one({"_id": product_id, "visible": True},
+                                          _summary_pipeline(calificacion), session=s).matched_count
+        if not matched:
+            # Aborts the transaction; without one, the orphan review is removed by hand
+            if s is None:
+                db[REVIEWS_COLLECTION].delete_one({"_id": review['_id']})
+            raise ReviewError("Producto no encontrado")
+
+    try:
+        if supports_transactions(db.client):
+            with db.client.start_session() as s:
+                s.with_transaction(write)
+        else:
+            write()
+    except DuplicateKeyError:
+        # Unique index on (producto_id, usuario_id)
+        raise ReviewError("Ya publicaste una reseña para este producto")
+    return review
+
+
+def get_reviews(db, product_id, after=None, page_size=REVIEW_PAGE_SIZE):
+    """
+    One page of a product's reviews, newest first, keyset-paginated on
+    (fecha, _id). Returns (reviews, next_cursor or None).
+    """
+    filtro = {"producto_id": product_id}
+    cursor = decode_cursor(after)
+    if cursor:
+        filtro.update(keyset_filter("fecha", -1, cursor))
+    reviews = list(db[REVIEWS_COLLECTION].find(filtro, REVIEW_PROJECTION)
+                   .sort([("fecha", -1), ("_id", -1)]).limit(page_size + 1))
+    if len(reviews) <= page_size:
+        return reviews, None
+    reviews = reviews[:page_size]
+    return reviews, encode_cursor(reviews[-1], "fecha")
+
+
+def migrate_embedded(db, batch_size=500):
+    """
+    Moves reviews embedded in productos.reseñas into the reviews collection,
+    sets the rating summary from them and drops the array. Products without
+    reviews get an empty summary so rating sorts and filters see every product.
+    Re-running only touches products that still carry the array; duplicates
+    of a user's review of the same product are skipped by the unique index.
+    """
+    moved = 0
+    ops = []
+    for product in db.productos.find({"reseñas": {"$exists": True}}, {"reseñas": 1}):
+        docs = []
+        for r in product.get('reseñas') or []:
+            try:
+                calificacion = int(r.get('calificacion') or r.get('rating'))
+            except (TypeError, ValueError):
+                continue
+            docs.append({
+                "producto_id": product['_id'],
+                "usuario_id": r.get('usuario_id'),
+                "autor": r.get('autor') or r.get('nombre', ''),
+                "calificacion": max(MIN_RATING, min(calificacion, MAX_RATING)),
+                "comentario": r.get('comentario', ''),
+                "fecha": r.get('fecha') or datetime.utcnow()
+            })
+        if docs:
+            try:
+                moved += len(db[REVIEWS_COLLECTION].insert_many(docs, ordered=False).inserted_ids)
+            except BulkWriteError as e:
+                moved += e.details.get("nInserted", 0)
+        total = sum(d['calificacion'] for d in docs)
+        ops.append(UpdateOne({"_id": product['_id']}, {
+            "$set": {"rating_count": len(docs), "rating_sum": total,
+                     "rating_avg": round(total / len(docs), 2) if docs else 0},
+            "$unset": {"reseñas": ""}
+        }))
+        if len(ops) >= batch_size:
+            db.productos.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        db.productos.bulk_write(ops, ordered=False)
+
+    # Products created without the array (imports, admin form) and never reviewed
+    db.productos.update_many({"rating_count": {"$exists": False}}, {"$set": EMPTY_RATING})
+    return moved
+
+if __name__ == "__main__":
+    db = get_database(check=True)
+    if db is not None:
+        print(f"Reseñas migradas: {migrate_embedded(db)}")
@@ -0,0 +1,161 @@
+from pymongo import UpdateOne
+from database import get_database
+
+# Precomputed sales figures read by /admin and /admin/analytics.
+#   ventas_periodos:   {_id: "total" | "YYYY-MM" | "YYYY-MM-DD", periodo, total, pedidos}
+#   ventas_productos:  {_id: producto_id, quantity, revenue}
+#   ventas_categorias: {_id: categoria_id, quantity, revenue}
+#   ventas_clientes:   {_id: usuario_id, total, pedidos}   (shown on /dashboard)
+PERIODOS = "ventas_periodos"
+PRODUCTOS = "ventas_productos"
+CATEGORIAS = "ventas_categorias"
+CLIENTES = "ventas_clientes"
+
+
+def _line_categories(db, items, session=None):
+    """
+    producto_id -> categoria_id for the order lines. Lines snapshot the
+    category when added to the cart; older lines fall back to one $in query.
+    """
+    categories = {item['producto_id']: item['categoria_id'] for item in items if item.get('categoria_id')}
+    missing = [item['producto_id'] for item in items if item['producto_id'] not in categories]
+    if missing:
+        for p in db.productos.find({"_id": {"$in": missing}}, {"categoria.id": 1}, session=session):
+            categories[p['_id']] = p.get('categoria', {}).get('id')
+    return categories
+
+
+def record_order(db, order, session=None):
+    """
+    Folds one new order into the rollups with $inc upserts.
+    Called from checkout, inside the order transaction when there is one.
+    """
+    fecha = order['fecha_pedido']
+    total = order.get('total', 0)
+    periods = [("total", "total"), (fecha.strftime('%Y-%m'), "mes"), (fecha.strftime('%Y-%m-%d'), "dia")]
+    db[PERIODOS].bulk_write([
+        UpdateOne({"_id": key}, {"$inc": {"total": total, "pedidos": 1}, "$set": {"periodo": periodo}}, upsert=True)
+        for key, periodo in periods
+    ], ordered=False, session=session)
+
+    if order.get('usuario_id') is not None:
+        db[CLIENTES].update_one({"_id": order['usuario_id']},
+                                {"$inc": {"total": total, "pedidos": 1}}, upsert=True, session=session)
+
+    items = order.get('items', [])
+    if not items:
+        return
+
+    categories = _line_categories(db, items, session=session)
+    by_product, by_category = {}, {}
+    for item in items:
+        quantity = item['cantidad']
+        revenue = item['cantidad'] * item['precio_unitario']
+        for bucket, key in ((by_product, item['producto_id']), (by_category, categories.get(item['producto_id']))):
+            if key is None:
+                continue
+            q, r = bucket.get(key, (0, 0))
+            bucket[key] = (q + quantity, r + revenue)
+
+    for collection, bucket in ((PRODUCTOS, by_product), (CATEGORIAS, by_category)):
+        if not bucket:
+            continue
+        db[collection].bulk_write([
+            UpdateOne({"_id": key}, {"$inc": {"quantity": q, "revenue": r}}, upsert=True)
+            for key, (q, r) in bucket.items()
+        ], ordered=False, session=session)
+
+
+def get_totals(db):
+    doc = db[PERIODOS].find_one({"_id": "total"}) or {}
+    return doc.get('total', 0), doc.get('pedidos', 0)
+
+
+def get_customer_totals(db, user_id):
+    """
+    (lifetime total, order count) for one customer.
+    """
+    doc = db[CLIENTES].find_one({"_id": user_id}) or {}
+    return doc.get('total', 0), doc.get('pedidos', 0)
+
+
+def get_monthly(db):
+    return list(db[PERIODOS].find({"periodo": "mes"}, {"total": 1}).sort("_id", 1))
+
+
+def top_products_pipeline(limit=5):
+    """
+    Best sellers with the product name joined in-pipeline after $limit,
+    so the lookup touches at most `limit` products in a single round-trip.
+    """
+    return [
+        {"$sort": {"quantity": -1}},
+        {"$limit": limit},
+        {"$lookup": {"from": "productos", "localField": "_id", "foreignField": "_id",
+                     "pipeline": [{"$project": {"nombre": 1}}], "as": "producto"}},
+        {"$set": {"nombre": {"$first": "$producto.nombre"}}},
+        {"$unset": "producto"}
+    ]
+
+
+def get_top_products(db, limit=5):
+    return list(db[PRODUCTOS].aggregate(top_products_pipeline(limit)))
+
+
+def get_top_category(db):
+    return db[CATEGORIAS].find_one(sort=[("revenue", -1)])
+
+
+def rebuild(db):
+    """
+    Recomputes every rollup from pedidos with $merge. Order history is
+    append-only, so replacing matched documents covers every existing key.
+    Run it on a schedule (or after imports) while checkout traffic is quiet.
+    """
+    line_value = {"$multiply": ["$items.cantidad", "$items.precio_unitario"]}
+
+    for periodo, fmt in (("mes", "%Y-%m"), ("dia", "%Y-%m-%d")):
+        db.pedidos.aggregate([
+            {"$match": {"fecha_pedido": {"$exists": True}}},
+            {"$group": {
+                "_id": {"$dateToString": {"format": fmt, "date": "$fecha_pedido"}},
+                "total": {"$sum": "$total"},
+                "pedidos": {"$sum": 1}
+            }},
+            {"$set": {"periodo": periodo}},
+            {"$merge": {"into": PERIODOS, "whenMatched": "replace", "whenNotMatched": "insert"}}
+        ])
+
+    db.pedidos.aggregate([
+        {"$group": {"_id": "total", "total": {"$sum": "$total"}, "pedidos": {"$sum": 1}}},
+        {"$set": {"periodo": "total"}},
+        {"$merge": {"into": PERIODOS, "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ])
+
+    db.pedidos.aggregate([
+        {"$group": {"_id": "$usuario_id", "total": {"$sum": "$total"}, "pedidos": {"$sum": 1}}},
+        {"$merge": {"into": CLIENTES, "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ])
+
+    db.pedidos.aggregate([
+        {"$unwind": "$items"},
+        {"$group": {"_id": "$items.producto_id", "quantity": {"$sum": "$items.cantidad"}, "revenue": {"$sum": line_value}}},
+        {"$merge": {"into": PRODUCTOS, "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ])
+
+    db.pedidos.aggregate([
+        {"$unwind": "$items"},
+        {"$lookup": {"from": "productos", "localField": "items.producto_id", "foreignField": "_id",
+                     "pipeline": [{"$project": {"categoria.id": 1}}], "as": "prod"}},
+        {"$unwind": "$prod"},
+        {"$group": {"_id": "$prod.categoria.id", "quantity": {"$sum": "$items.cantidad"}, "revenue": {"$sum": line_value}}},
+        {"$merge": {"into": CATEGORIAS, "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ])
+
+if __name__ == "__main__":
+    db = get_database(check=True)
+    if db is not None:
+        from indexes import INDEXES, apply_indexes
+        apply_indexes(db, {name: INDEXES[name] for name in (PERIODOS, PRODUCTOS, CATEGORIAS)})
+        rebuild(db)
+        print("Sales rollups rebuilt.")
@@ -0,0 +1,180 @@
+import os
+import secrets
+from datetime import datetime, timedelta
+from flask.sessions import SessionInterface, SessionMixin
+
+# Server-side sessions stored in MongoDB; the cookie only carries an opaque id.
+SESSION_COLLECTION = "sesiones"
+SESSION_TTL = timedelta(seconds=int(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600))))
+
+# Fields copied from usuarios into the session profile
+SESSION_USER_PROJECTION = {"nombre": 1, "email": 1, "role": 1, "direcciones": {"$slice": 1}}
+
+
+def session_profile(user):
+    """
+    Compact user profile kept in the session, so authenticated routes can
+    read name, role and default shipping address without querying usuarios.
+    """
+    direcciones = user.get('direcciones') or []
+    return {
+        'id': str(user['_id']),
+        'nombre': user['nombre'],
+        'email': user['email'],
+        'role': user.get('role', 'customer'),
+        'direccion': direcciones[0] if direcciones else {}
+    }
+
+
+class ServerSideSession(dict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        super().__init__(initial or {})
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # Id this session had before regenerate(); its document is deleted on save
+        self.previous_sid = None
+
+    def regenerate(self):
+        """
+        Moves the session to a fresh id and drops its data. Called on login
+        and logout, so an id handed out before authentication (or known to
+        someone else) never becomes an authenticated session.
+        """
+        if not self.new:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.clear()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.modified = True
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.modified = True
+
+    def pop(self, key, *args):
+        self.modified = self.modified or key in self
+        return super().pop(key, *args)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.modified = True
+        return super().setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.modified = True
+
+    def clear(self):
+        super().clear()
+        self.modified = True
+
+
+class MongoSessionInterface(SessionInterface):
+    """
+    Flask session backend on a MongoDB collection with a TTL index on `expira`.
+    A session is only written when it changes or when more than half of its
+    lifetime has passed, and anonymous visitors without data never touch it.
+    """
+
+    def __init__(self, db, collection=SESSION_COLLECTION, ttl=SESSION_TTL):
+        self.db = db
+        self.collection_name = collection
+        self.ttl = ttl
+
+    @property
+    def collection(self):
+        return self.db[self.collection_name]
+
+    # The helpers below hold all the logic so an async front end (asgi.py)
+    # can reuse it with a different driver.
+
+    def _session_id(self, app, request):
+        return request.cookies.get(self.get_cookie_name(app))
+
+    @staticmethod
+    def _lookup(sid):
+        return {"_id": sid, "expira": {"$gt": datetime.utcnow()}}
+
+    @staticmethod
+    def _from_doc(sid, doc):
+        if not doc:
+            return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+        s = ServerSideSession(doc.get('data'), sid=sid)
+        s.expira = doc['expira']
+        return s
+
+    def _write_plan(self, session):
+        """
+        Returns None (nothing to do), ("delete", None) or ("save", (expira, update)).
+        """
+        if not session:
+            if session.modified and (not session.new or session.previous_sid):
+                return ("delete", None)
+            return None
+
+        now = datetime.utcnow()
+        expira = getattr(session, 'expira', None)
+        stale = expira is None or expira - now < self.ttl / 2
+        if not (session.modified or stale):
+            return None
+
+        expira = now + self.ttl
+        user = session.get('user') or {}
+        update = {"$set": {"data": dict(session), "user_id": user.get('id'), "expira": expira}}
+        return ("save", (expira, update))
+
+    def _apply_cookie(self, app, session, response, action, expira=None):
+        cookie_name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if action == "delete":
+            response.delete_cookie(cookie_name, domain=domain, path=path)
+            return
+        response.set_cookie(
+            cookie_name, session.sid,
+            expires=expira,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    def open_session(self, app, request):
+        sid = self._session_id(app, request)
+        doc = self.collection.find_one(self._lookup(sid)) if sid else None
+        return self._from_doc(sid, doc)
+
+    def save_session(self, app, session, response):
+        if session.previous_sid:
+            self.collection.delete_one({"_id": session.previous_sid})
+        plan = self._write_plan(session)
+        if plan is None:
+            return
+        action, payload = plan
+        if action == "delete":
+            self.collection.delete_one({"_id": session.sid})
+            self._apply_cookie(app, session, response, action)
+            return
+        expira, update = payload
+        self.collection.update_one({"_id": session.sid}, update, upsert=True)
+        self._apply_cookie(app, session, response, action, expira)
+
+
+
+def refresh_user_sessions(db, user_id):
+    """
+    Invalidation hook: call after every write to a user document so each live
+    session of that user picks up the new profile, or is dropped if the user
+    no longer exists or is no longer active.
+    """
+    sesiones = db[SESSION_COLLECTION]
+    user = db.usuarios.find_one({"_id": user_id}, {"estado": 1, **SESSION_USER_PROJECTION})
+    if user is None or user.get('estado', 'activo') != 'activo':
+        sesiones.delete_many({"user_id": str(user_id)})
+        return
+    sesiones.update_many({"user_id": str(user_id)}, {"$set": {"data.user": session_profile(user)}})
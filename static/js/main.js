@@ -1,2 +1,52 @@
 // Main JS file for interactions
 console.log("NEOStore app loaded.");
+
+// Cart badge in the header (reads only the stored totals via /cart/summary)
+function updateCartBadge(summary) {
+    const badge = document.getElementById('cart-badge');
+    if (!badge || !summary) return;
+    badge.textContent = summary.cantidad_items;
+    badge.hidden = !summary.cantidad_items;
+}
+
+document.addEventListener('DOMContentLoaded', async function () {
+    if (!document.getElementById('cart-badge')) return;
+    try {
+        const response = await fetch('/cart/summary');
+        if (response.ok) updateCartBadge(await response.json());
+    } catch (error) {
+        console.error('Error fetching cart summary:', error);
+    }
+});
+
+// Search autocomplete (uses the anchored prefix index via /search/suggest)
+document.addEventListener('DOMContentLoaded', function () {
+    const input = document.querySelector('.search-input[list="search-suggestions"]');
+    const datalist = document.getElementById('search-suggestions');
+    if (!input || !datalist) return;
+
+    let timer = null;
+    let lastQuery = '';
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        const query = this.value.trim();
+        if (query.length < 2 || query === lastQuery) return;
+
+        timer = setTimeout(async () => {
+            lastQuery = query;
+            try {
+                const response = await fetch(`/search/suggest?q=${encodeURIComponent(query)}`);
+                const data = await response.json();
+                datalist.innerHTML = '';
+                data.suggestions.forEach(s => {
+                    const option = document.createElement('option');
+                    option.value = s.nombre;
+                    datalist.appendChild(option);
+                });
+            } catch (error) {
+                console.error('Error fetching suggestions:', error);
+            }
+        }, 150);
+    });
+});
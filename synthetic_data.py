@@ -0,0 +1,225 @@
+import hashlib
+import random
+import struct
+import time
+from datetime import datetime, timedelta, timezone
+from multiprocessing import get_context
+from bson.objectid import ObjectId
+from catalog import normalize_text
+from database import get_database
+from reviews import EMPTY_RATING
+
+# Defaults for `python init_db.py --synthetic`
+DEFAULT_PRODUCTS = 100000
+DEFAULT_USERS = 10000
+DEFAULT_ORDERS = 1000000
+DEFAULT_DAYS = 730
+DEFAULT_WORKERS = 4
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_SEED = 42
+
+# Rows handed to a worker per task
+CHUNK_SIZE = 50000
+
+# Items per order and units per line, weighted like a typical storefront
+ITEMS_PER_ORDER = ([1, 2, 3, 4, 5, 6], [50, 25, 12, 7, 4, 2])
+UNITS_PER_LINE = ([1, 2, 3], [80, 15, 5])
+
+ADJETIVOS = ["Pro", "Ultra", "Lite", "Max", "Classic", "Plus", "Mini", "Neo", "Prime", "Eco"]
+SUSTANTIVOS = ["Laptop", "Smartphone", "Auriculares", "Monitor", "Buzo", "Camiseta", "Falda",
+               "Anillo", "Collar", "Figura", "Sobre TCG", "Gafas"]
+CIUDADES = ["Bogotá", "Medellín", "Cali", "Barranquilla", "Cartagena", "Lima", "Quito", "Madrid"]
+
+_EPOCH = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+# "Now" of the generated data: dates count back from here, never from the
+# wall clock, so a seed yields the same documents (and rollup buckets) any day
+REFERENCE_DATE = datetime(2026, 1, 1)
+_PASSWORD = hashlib.sha256("user123".encode()).hexdigest()
+
+
+def _synthetic_id(kind, index):
+    """
+    Deterministic ObjectId for row `index` of `kind` (4 ASCII bytes), so order
+    workers can reference products and users without querying them.
+    """
+    return ObjectId(struct.pack(">i", _EPOCH) + kind + struct.pack(">I", index))
+
+
+def seeded_object_id(rng):
+    return ObjectId(rng.getrandbits(96).to_bytes(12, "big"))
+
+
+def category_ids(seed=DEFAULT_SEED):
+    """
+    Id factory for the base categories (init_db.py): the same seed yields the
+    same ids in creation order, so products and orders map to the same
+    categories on every run.
+    """
+    rng = random.Random(f"{seed}:categorias")
+    return lambda: seeded_object_id(rng)
+
+
+def product_id(index):
+    return _synthetic_id(b"PROD", index)
+
+
+def user_id(index):
+    return _synthetic_id(b"USER", index)
+
+
+def order_id(index):
+    return _synthetic_id(b"PEDI", index)
+
+
+def product_fields(index):
+    """
+    Name, sku and price of synthetic product `index`: a pure function of the
+    index so products and the order lines that snapshot them always agree.
+    """
+    nombre = f"{SUSTANTIVOS[index % len(SUSTANTIVOS)]} {ADJETIVOS[(index // 7) % len(ADJETIVOS)]} {index}"
+    precio = 499 + (index * 7919) % 199500
+    return nombre, f"SYN-{index:08d}", precio
+
+
+def _products(start, count, rng, categories):
+    now = REFERENCE_DATE
+    for i in range(start, start + count):
+        nombre, sku, precio = product_fields(i)
+        cat_id, cat_nombre = categories[i % len(categories)]
+        yield {
+            "_id": product_id(i),
+            "sku": sku,
+            "nombre": nombre,
+            "nombre_normalizado": normalize_text(nombre),
+            "descripcion": f"{nombre}: producto sintético para pruebas de carga.",
+            "categoria": {"id": cat_id, "nombre": cat_nombre},
+            "precio": precio,
+            "moneda": "USD",
+            "stock": rng.randint(0, 500),
+            "atributos": {"marca": f"Marca {rng.randint(1, 200)}"},
+            "imagenes": [],
+            "fecha_creacion": now - timedelta(days=rng.randint(0, 1000)),
+            "visible": rng.random() > 0.05,
+            **EMPTY_RATING
+        }
+
+
+def _users(start, count, rng, categories):
+    now = REFERENCE_DATE
+    for i in range(start, start + count):
+        yield {
+            "_id": user_id(i),
+            "nombre": f"Cliente {i}",
+            "email": f"cliente{i}@example.com",
+            "password": _PASSWORD,
+            "role": "customer",
+            "telefono": f"3{rng.randint(100000000, 999999999)}",
+            "direcciones": [{
+                "alias": "Casa",
+                "calle": f"Calle {rng.randint(1, 200)} # {rng.randint(1, 99)}-{rng.randint(1, 99)}",
+                "ciudad": rng.choice(CIUDADES),
+                "pais": "Colombia",
+                "codigo_postal": f"{rng.randint(10000, 99999)}"
+            }],
+            "fecha_registro": now - timedelta(days=rng.randint(0, 1500)),
+            "estado": "activo",
+            "preferencias": {"idioma": "es", "moneda": "USD"}
+        }
+
+
+def _orders(start, count, rng, categories, n_products, n_users, days):
+    now = REFERENCE_DATE
+    for i in range(start, start + count):
+        # Skewed towards recent dates, with lighter weekends
+        fecha = now - timedelta(days=rng.betavariate(1.2, 2.5) * days, seconds=rng.randint(0, 86399))
+        if fecha.weekday() >= 5 and rng.random() < 0.3:
+            fecha -= timedelta(days=2)
+
+        items = []
+        for _ in range(rng.choices(*ITEMS_PER_ORDER)[0]):
+            # Popularity follows a power law: low indexes sell the most
+            p = int(n_products * rng.random() ** 3)
+            nombre, sku, precio = product_fields(p)
+            items.append({
+                "producto_id": product_id(p),
+                "nombre": nombre,
+                "sku": sku,
+                "cantidad": rng.choices(*UNITS_PER_LINE)[0],
+                "precio_unitario": precio,
+                "categoria_id": categories[p % len(categories)][0],
+                "atributos": {}
+            })
+        total = sum(it["cantidad"] * it["precio_unitario"] for it in items)
+        yield {
+            "_id": order_id(i),
+            "usuario_id": user_id(rng.randrange(n_users)),
+            "numero_pedido": f"SYN-{i:09d}",
+            "items": items,
+            "subtotal": total,
+            "impuestos": 0,
+            "descuentos": 0,
+            "total": total,
+            "estado": rng.choices(["ENTREGADO", "ENVIADO", "CREADO", "CANCELADO"], [70, 15, 10, 5])[0],
+            "direccion_envio": {},
+            "pago": {"metodo": "simulado", "estado": "aprobado", "fecha": fecha},
+            "fecha_pedido": fecha
+        }
+
+
+_GENERATORS = {"usuarios": _users, "productos": _products, "pedidos": _orders}
+
+
+def _load_chunk(task):
+    """
+    Worker entry point: generates rows [start, start+count) of one collection
+    with an RNG seeded from (seed, collection, start) and inserts them in batches.
+    """
+    collection, start, count, options = task
+    rng = random.Random(f"{options['seed']}:{collection}:{start}")
+    extra = ()
+    if collection == "pedidos":
+        extra = (options["products"], options["users"], options["days"])
+    db = get_database()
+    batch = []
+    for doc in _GENERATORS[collection](start, count, rng, options["categories"], *extra):
+        batch.append(doc)
+        if len(batch) >= options["batch_size"]:
+            db[collection].insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db[collection].insert_many(batch, ordered=False)
+    return count
+
+
+def load(db, products=DEFAULT_PRODUCTS, users=DEFAULT_USERS, orders=DEFAULT_ORDERS, days=DEFAULT_DAYS,
+         workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE, seed=DEFAULT_SEED):
+    """
+    Bulk-loads synthetic users, products and orders with `workers` processes.
+    The same seed always produces the same data (ids included, dates counted
+    back from REFERENCE_DATE), provided the categories were created with
+    category_ids(seed) as init_db.py does. Create indexes afterwards.
+    """
+    categories = [(c['_id'], c['nombre']) for c in db.categorias.find({}, {"nombre": 1}).sort("_id", 1)]
+    if not categories:
+        raise ValueError("Se necesitan categorías antes de generar productos")
+
+    if orders > 0 and (products < 1 or users < 1):
+        # Orders reference generated products and users by index
+        raise ValueError("Generar pedidos requiere al menos un producto y un usuario")
+
+    options = {"categories": categories, "products": products, "users": users,
+               "days": days, "batch_size": batch_size, "seed": seed}
+
+    with get_context("spawn").Pool(workers) as pool:
+        for collection, total in (("usuarios", users), ("productos", products), ("pedidos", orders)):
+            if total <= 0:
+                continue
+            started = time.perf_counter()
+            tasks = [(collection, start, min(CHUNK_SIZE, total - start), options)
+                     for start in range(0, total, CHUNK_SIZE)]
+            done = 0
+            for n in pool.imap_unordered(_load_chunk, tasks):
+                done += n
+                print(f"  {collection}: {done}/{total}", end="\r")
+            elapsed = time.perf_counter() - started
+            print(f"  {collection}: {total} documentos en {elapsed:.1f}s ({total / elapsed:.0f}/s)")